@@ -0,0 +1,167 @@
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Tuple
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+# Raw ticks are kept this many days, then their daily partition is dropped
+TICKS_RETENTION_DAYS = int(os.getenv("TICKS_RETENTION_DAYS", 7))
+# Retention of each rollup resolution in days, 0 keeps it forever
+ROLLUP_RETENTION_DAYS = {
+    60: int(os.getenv("ROLLUP_1M_RETENTION_DAYS", 30)),
+    3600: int(os.getenv("ROLLUP_1H_RETENTION_DAYS", 400)),
+    86400: int(os.getenv("ROLLUP_1D_RETENTION_DAYS", 0)),
+}
+# Partitions created ahead of time, so inserts never miss one around midnight
+PARTITIONS_AHEAD_DAYS = 2
+
+PARTITION_PREFIX = "price_ticks_"
+
+HISTORY_DDL = """
+    CREATE TABLE IF NOT EXISTS price_ticks (
+        coin_id_text TEXT NOT NULL,
+        ts TIMESTAMP NOT NULL,
+        price NUMERIC NOT NULL
+    ) PARTITION BY RANGE (ts);
+    CREATE INDEX IF NOT EXISTS price_ticks_coin_ts_idx ON price_ticks (coin_id_text, ts);
+
+    CREATE TABLE IF NOT EXISTS price_rollups (
+        coin_id_text TEXT NOT NULL,
+        resolution INTEGER NOT NULL,
+        bucket TIMESTAMP NOT NULL,
+        open NUMERIC NOT NULL,
+        high NUMERIC NOT NULL,
+        low NUMERIC NOT NULL,
+        close NUMERIC NOT NULL,
+        PRIMARY KEY (coin_id_text, resolution, bucket)
+    );
+"""
+
+# Rebuild the 1-minute buckets of the current run from raw ticks
+MINUTE_ROLLUP_QUERY = """
+    INSERT INTO price_rollups (coin_id_text, resolution, bucket, open, high, low, close)
+    SELECT coin_id_text,
+           60,
+           date_trunc('minute', ts) AS bucket,
+           (array_agg(price ORDER BY ts))[1],
+           MAX(price),
+           MIN(price),
+           (array_agg(price ORDER BY ts DESC))[1]
+    FROM price_ticks
+    WHERE coin_id_text = ANY(%(coin_ids)s) AND ts >= date_trunc('minute', NOW())
+    GROUP BY coin_id_text, bucket
+    ON CONFLICT (coin_id_text, resolution, bucket) DO UPDATE
+        SET open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low, close = EXCLUDED.close
+"""
+
+# Rebuild the current bucket of a coarser resolution from the next finer one
+COARSE_ROLLUP_QUERY = """
+    INSERT INTO price_rollups (coin_id_text, resolution, bucket, open, high, low, close)
+    SELECT coin_id_text,
+           %(resolution)s,
+           date_trunc(%(unit)s, bucket) AS coarse_bucket,
+           (array_agg(open ORDER BY bucket))[1],
+           MAX(high),
+           MIN(low),
+           (array_agg(close ORDER BY bucket DESC))[1]
+    FROM price_rollups
+    WHERE coin_id_text = ANY(%(coin_ids)s)
+      AND resolution = %(source_resolution)s
+      AND bucket >= date_trunc(%(unit)s, NOW())
+    GROUP BY coin_id_text, coarse_bucket
+    ON CONFLICT (coin_id_text, resolution, bucket) DO UPDATE
+        SET open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low, close = EXCLUDED.close
+"""
+
+# (resolution, date_trunc unit, source resolution)
+COARSE_ROLLUPS = ((3600, "hour", 60), (86400, "day", 3600))
+
+
+def _partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+def ensure_schema(conn: psycopg2.extensions.connection):
+    with conn.cursor() as cursor:
+        cursor.execute(HISTORY_DDL)
+    conn.commit()
+    ensure_partitions(conn)
+
+
+def ensure_partitions(conn: psycopg2.extensions.connection):
+    today = datetime.now(timezone.utc).date()
+    with conn.cursor() as cursor:
+        for offset in range(PARTITIONS_AHEAD_DAYS + 1):
+            day = today + timedelta(days=offset)
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {_partition_name(day)} PARTITION OF price_ticks "
+                f"FOR VALUES FROM ('{day}') TO ('{day + timedelta(days=1)}')"
+            )
+    conn.commit()
+
+
+def record_ticks(conn: psycopg2.extensions.connection, update_ids: List[Tuple[str, float]], chunk_size: int):
+    """
+    Append the fetched prices to price_ticks and refresh the OHLC buckets they fall into.
+    Runs inside the caller's transaction.
+    """
+    coin_ids = [id_text for id_text, _ in update_ids]
+
+    with conn.cursor() as cursor:
+        for i in range(0, len(update_ids), chunk_size):
+            chunk = update_ids[i : i + chunk_size]
+            execute_values(
+                cursor,
+                "INSERT INTO price_ticks (coin_id_text, ts, price) VALUES %s",
+                chunk,
+                template="(%s, NOW(), %s)",
+                page_size=len(chunk),
+            )
+
+        cursor.execute(MINUTE_ROLLUP_QUERY, {"coin_ids": coin_ids})
+        for resolution, unit, source_resolution in COARSE_ROLLUPS:
+            cursor.execute(
+                COARSE_ROLLUP_QUERY,
+                {
+                    "coin_ids": coin_ids,
+                    "resolution": resolution,
+                    "unit": unit,
+                    "source_resolution": source_resolution,
+                },
+            )
+
+
+def apply_retention(conn: psycopg2.extensions.connection):
+    """
+    Drop tick partitions older than TICKS_RETENTION_DAYS and delete expired rollups.
+    """
+    cutoff = datetime.now(timezone.utc).date() - timedelta(days=TICKS_RETENTION_DAYS)
+
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = 'price_ticks'
+            """
+        )
+        for (partition,) in cursor.fetchall():
+            try:
+                day = datetime.strptime(partition[len(PARTITION_PREFIX) :], "%Y%m%d").date()
+            except ValueError:
+                continue
+            if day < cutoff:
+                cursor.execute(f"DROP TABLE IF EXISTS {partition}")
+                logging.info(f"Dropped price tick partition {partition}")
+
+        for resolution, days in ROLLUP_RETENTION_DAYS.items():
+            if days > 0:
+                cursor.execute(
+                    "DELETE FROM price_rollups WHERE resolution = %s AND bucket < NOW() - make_interval(days => %s)",
+                    (resolution, days),
+                )
+    conn.commit()
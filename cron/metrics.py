@@ -0,0 +1,71 @@
+import logging
+import os
+from time import time
+from typing import Dict
+
+from prometheus_client import (REGISTRY, Counter, Gauge, Histogram,
+                               start_http_server, write_to_textfile)
+
+# Port serving /metrics for Prometheus to scrape, 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# File rewritten after every run, for the node_exporter textfile collector
+METRICS_FILE = os.getenv("METRICS_FILE")
+
+RUN_DURATION = Histogram(
+    "updater_run_duration_seconds",
+    "Wall time of refresh runs that had coins due.",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+RUNS = Counter("updater_runs_total", "Refresh runs by outcome.", ["outcome"])
+COINS = Counter(
+    "updater_coins_total",
+    "Due coins by result: price changed and written, unchanged, or missing from the API response.",
+    ["result"],
+)
+COINS_DUE = Gauge("updater_coins_due", "Coins due in the last run.")
+STALENESS = Gauge(
+    "updater_staleness_seconds",
+    "How long past its due time the most overdue coin was when the last run started.",
+)
+LAST_SUCCESS = Gauge("updater_last_success_timestamp_seconds", "Unix time of the last successful run.")
+COINGECKO_REQUEST_DURATION = Histogram(
+    "coingecko_request_duration_seconds",
+    "Latency of CoinGecko requests by endpoint and status code.",
+    ["endpoint", "status"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+
+def start():
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+        logging.info(f"Serving metrics on port {METRICS_PORT}")
+
+
+def flush():
+    if METRICS_FILE:
+        try:
+            write_to_textfile(METRICS_FILE, REGISTRY)
+        except OSError as e:
+            logging.warning(f"Could not write metrics to {METRICS_FILE}: {e}")
+
+
+def record_run(summary: Dict):
+    """
+    Record a successful run from the summary returned by run_cron_task.
+    """
+    RUNS.labels("ok").inc()
+    COINS_DUE.set(summary["due"])
+    STALENESS.set(summary["staleness_s"])
+    LAST_SUCCESS.set(time())
+    if summary["due"]:
+        RUN_DURATION.observe(summary["wall_time_s"])
+        COINS.labels("changed").inc(summary["changed"])
+        COINS.labels("unchanged").inc(summary["unchanged"])
+        COINS.labels("missing").inc(summary["due"] - summary["changed"] - summary["unchanged"])
+    flush()
+
+
+def record_failure():
+    RUNS.labels("error").inc()
+    flush()
@@ -1,10 +1,20 @@
+import json
 import logging
 import os
-from time import sleep
-from typing import List, Tuple
+import random
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+from typing import Dict, List, Tuple
 
+import history
+import metrics
 import psycopg2
+import redis
 import requests
+import scheduler
+from psycopg2.extras import execute_values
+from rate_limit import TokenBucket
+from requests.adapters import HTTPAdapter
 
 logging.basicConfig(
     level=logging.INFO,
@@ -14,118 +24,283 @@ logging.basicConfig(
 API_COIN_KEY = os.getenv("COINGECKO_KEY")
 API_COIN_URL = os.getenv("COINGECKO_URL")
 
-# Connect
+# Max ids per simple/price call
+COINGECKO_BATCH_SIZE = int(os.getenv("COINGECKO_BATCH_SIZE", 250))
+# Parallel simple/price calls
+COINGECKO_CONCURRENCY = int(os.getenv("COINGECKO_CONCURRENCY", 4))
+# Calls per minute allowed by our CoinGecko plan
+COINGECKO_RATE_PER_MINUTE = int(os.getenv("COINGECKO_RATE_PER_MINUTE", 30))
+COINGECKO_MAX_RETRIES = int(os.getenv("COINGECKO_MAX_RETRIES", 5))
+COINGECKO_TIMEOUT = float(os.getenv("COINGECKO_TIMEOUT", 10))
+
+# The scheduler is polled every tick; holder tiers are recomputed every sync interval
+REFRESH_TICK_SECONDS = int(os.getenv("REFRESH_TICK_SECONDS", 15))
+SCHEDULE_SYNC_SECONDS = int(os.getenv("SCHEDULE_SYNC_SECONDS", 300))
+# Coins refreshed per tick, by default what the rate limit allows within one tick
+MAX_COINS_PER_TICK = int(
+    os.getenv(
+        "MAX_COINS_PER_TICK",
+        max(1, COINGECKO_RATE_PER_MINUTE * REFRESH_TICK_SECONDS // 60) * COINGECKO_BATCH_SIZE,
+    )
+)
+# Rows per set-based UPDATE statement
+DB_WRITE_CHUNK_SIZE = int(os.getenv("DB_WRITE_CHUNK_SIZE", 5000))
+# Prices that moved by at most this fraction of the last written price are not rewritten
+PRICE_CHANGE_EPSILON = float(os.getenv("PRICE_CHANGE_EPSILON", 0.0001))
+
 DATABASE_URL = os.getenv("DATABASE_URL")
-conn = psycopg2.connect(DATABASE_URL)
-cursor = conn.cursor()
 
+REDIS_HOST = os.getenv("REDIS_HOST")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_DB = int(os.getenv("REDIS_DB", 0))
+# Changed prices are published here for the FastAPI price streams
+PRICE_CHANNEL = os.getenv("PRICE_CHANNEL", "prices")
+# Bumped with every publish, the FastAPI app derives portfolio ETags from it
+PRICES_VERSION_KEY = "prices:version"
 
-def get_coin_price(coin_ids_text, currency="usd"):
-    url = API_COIN_URL + "simple/price?ids=" + coin_ids_text + "&vs_currencies=" + currency
-    payload = {}
-    headers = {"x-cg-api-key": API_COIN_KEY}
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
 
-    response = requests.request("GET", url, headers=headers, data=payload)
+rate_limiter = TokenBucket(rate=COINGECKO_RATE_PER_MINUTE / 60, capacity=COINGECKO_CONCURRENCY)
+
+# id_text -> last price written to coins, reloaded on every schedule sync
+last_prices: Dict[str, float] = {}
+
+session = requests.Session()
+session.headers.update({"x-cg-api-key": API_COIN_KEY or ""})
+session.mount("https://", HTTPAdapter(pool_maxsize=COINGECKO_CONCURRENCY))
+session.mount("http://", HTTPAdapter(pool_maxsize=COINGECKO_CONCURRENCY))
+
+
+def _backoff_seconds(attempt: int, response=None) -> float:
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return min(60.0, 2**attempt) + random.uniform(0, 1)
+
+
+def get_coin_price(coin_ids_text, currency="usd") -> Tuple[Dict, int]:
+    """
+    Fetch prices of comma separated ids, retrying 429/5xx responses with backoff.
+    Returns the prices and the number of API calls made.
+    """
+    url = API_COIN_URL + "simple/price"
+    params = {"ids": coin_ids_text, "vs_currencies": currency}
+    calls = 0
+
+    for attempt in range(COINGECKO_MAX_RETRIES + 1):
+        rate_limiter.acquire()
+        calls += 1
+        status = "error"
+        started = perf_counter()
+        try:
+            response = session.get(url, params=params, timeout=COINGECKO_TIMEOUT)
+            status = str(response.status_code)
+        except requests.exceptions.Timeout:
+            logging.error("Request timeout")
+            sleep(_backoff_seconds(attempt))
+            continue
+        except requests.exceptions.TooManyRedirects:
+            logging.error("Too many redirects")
+            return {}, calls
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Request failed: {e}")
+            sleep(_backoff_seconds(attempt))
+            continue
+        finally:
+            metrics.COINGECKO_REQUEST_DURATION.labels("simple/price", status).observe(perf_counter() - started)
 
-    try:
         if response.status_code == 200:
             try:
                 response_json = response.json()
                 if isinstance(response_json, dict):
-                    return response_json
+                    return response_json, calls
                 else:
                     logging.error(f"Unexpected response format: {response_json}")
-                    return {}
+                    return {}, calls
 
             except ValueError as e:
                 logging.error(f"Error parsing JSON response: {e}")
-                return {}
-        else:
-            logging.error(f"Failed to fetch data. Status code: {response.status_code}, Response: {response.text}")
-            return {}
-    except requests.exceptions.Timeout:
-        logging.error("Request timeout")
-        return {}
-    except requests.exceptions.TooManyRedirects:
-        logging.error("Too many redirects")
-        return {}
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Request failed: {e}")
-        return {}
-
-
-def update_database(update_ids: List[Tuple[str, float]], conn: psycopg2.extensions.connection):
-    batch_size = 20
-    cursor = conn.cursor()
-
-    for i in range(0, len(update_ids), batch_size):
-        batch_ids = update_ids[i : i + batch_size]
-        update_values = []
-
-        for id_text, price in batch_ids:
-            update_values.append((price, id_text))
-
-        if update_values:
-            try:
-                update_query = """
-                    UPDATE coins
-                    SET price = %s
-                    WHERE id_text = %s
-                """
-                cursor.executemany(update_query, update_values)
-                logging.info(f"Updated {len(update_values)} rows in this batch.")
-
-                conn.commit()
-
-            except Exception as e:
-                logging.error(f"Error during batch update: {e}")
-                conn.rollback()
-    cursor.close()
-
-
-def run_cron_task():
-    currency = "usd"
-    query = """
-            SELECT id_text
-            FROM coins
-            WHERE last_updated < NOW() - INTERVAL '2 HOURS';
-            """
-
-    cursor.execute(query)
-    rows = cursor.fetchall()
-
-    if rows:
-        ids = [str(row[0]) for row in rows]
-
-        grouped_ids = []
-
-        # Call coingecko with max 20 crypto id
-        for i in range(0, len(ids), 20):
-            batch = ids[i : i + 20]
-            grouped_ids.append(", ".join(batch))
-
-            for group_id in grouped_ids:
-                coin_price = get_coin_price(group_id)
-
-                update_ids = []
-                for id_text in batch:
-                    if id_text not in coin_price or currency not in coin_price[id_text]:
-                        logging.warning("API did not return value")
-                    else:
-                        if len(update_ids) > 20:
-                            update_database(update_ids)
-                            update_ids.clear()
-
-                        price = coin_price.get(id_text, {}).get(currency, 0.0)
-                        update_ids.append((id_text, price))
-
-        if len(update_ids) > 20:
-            update_database(update_ids)
+                return {}, calls
+
+        if response.status_code in RETRY_STATUS_CODES:
+            backoff = _backoff_seconds(attempt, response)
+            logging.warning(f"CoinGecko answered {response.status_code}, retrying in {backoff:.1f} s")
+            if response.status_code == 429:
+                rate_limiter.drain(backoff)
+            sleep(backoff)
+            continue
+
+        logging.error(f"Failed to fetch data. Status code: {response.status_code}, Response: {response.text}")
+        return {}, calls
+
+    logging.error(f"Giving up on {coin_ids_text} after {calls} calls")
+    return {}, calls
+
+
+def load_last_prices(conn: psycopg2.extensions.connection):
+    """
+    Reload the last written price of every coin, which also picks up coins and
+    prices written by the FastAPI app since the previous load.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT id_text, price FROM coins")
+        prices = {id_text: float(price) for id_text, price in cursor if price is not None}
+    conn.commit()
+    last_prices.clear()
+    last_prices.update(prices)
+    logging.info(f"Loaded last prices of {len(last_prices)} coins")
+
+
+def split_changed(update_ids: List[Tuple[str, float]]) -> Tuple[List[Tuple[str, float]], int]:
+    """
+    Keep the prices that moved by more than PRICE_CHANGE_EPSILON relative to the
+    last written one. Returns the changed pairs and the number of unchanged ones.
+    """
+    changed = []
+    for id_text, price in update_ids:
+        last = last_prices.get(id_text)
+        if last is None or abs(price - last) > PRICE_CHANGE_EPSILON * abs(last):
+            changed.append((id_text, price))
+    return changed, len(update_ids) - len(changed)
+
+
+def update_database(update_ids: List[Tuple[str, float]], conn: psycopg2.extensions.connection) -> int:
+    """
+    Apply a whole refresh with one set-based UPDATE per chunk, stamping
+    last_updated in the same statement. The caller commits once per run.
+    Returns the number of updated rows.
+    """
+    update_query = """
+        UPDATE coins
+        SET price = v.price, last_updated = NOW()
+        FROM (VALUES %s) AS v(id_text, price)
+        WHERE coins.id_text = v.id_text
+    """
+    updated = 0
+
+    with conn.cursor() as cursor:
+        for i in range(0, len(update_ids), DB_WRITE_CHUNK_SIZE):
+            chunk = update_ids[i : i + DB_WRITE_CHUNK_SIZE]
+            execute_values(cursor, update_query, chunk, template="(%s, %s::numeric)", page_size=len(chunk))
+            updated += cursor.rowcount
+
+    logging.info(f"Updated {updated} rows in {-(-len(update_ids) // DB_WRITE_CHUNK_SIZE)} statements.")
+    return updated
+
+
+def group_ids(ids: List[str], batch_size: int = COINGECKO_BATCH_SIZE) -> List[List[str]]:
+    return [ids[i : i + batch_size] for i in range(0, len(ids), batch_size)]
+
+
+def fetch_prices(batches: List[List[str]], currency: str = "usd") -> Tuple[List[Tuple[str, float]], int]:
+    """
+    Fetch all batches concurrently within the rate limit.
+    Returns (id_text, price) pairs and the number of API calls made.
+    """
+    update_ids = []
+    api_calls = 0
+
+    with ThreadPoolExecutor(max_workers=COINGECKO_CONCURRENCY) as executor:
+        results = executor.map(lambda batch: get_coin_price(",".join(batch), currency), batches)
+
+        for batch, (coin_price, calls) in zip(batches, results):
+            api_calls += calls
+            for id_text in batch:
+                if id_text not in coin_price or currency not in coin_price[id_text]:
+                    logging.warning(f"API did not return value for {id_text}")
+                else:
+                    update_ids.append((id_text, coin_price[id_text][currency]))
+
+    return update_ids, api_calls
+
+
+def publish_prices(redis_conn, update_ids: List[Tuple[str, float]], currency: str = "usd"):
+    """
+    Publish changed prices as one message and bump the prices version. Runs once
+    the prices are committed; a failed publish does not fail the run.
+    """
+    if redis_conn is None or not update_ids:
+        return
+    try:
+        message = json.dumps({"currency": currency, "prices": dict(update_ids)})
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.incr(PRICES_VERSION_KEY)
+        pipe.publish(PRICE_CHANNEL, message)
+        _, receivers = pipe.execute()
+        logging.debug(f"Published {len(update_ids)} prices to {receivers} subscribers")
+    except redis.RedisError as e:
+        logging.warning(f"Could not publish prices: {e}")
+
+
+def run_cron_task(conn: psycopg2.extensions.connection, currency: str = "usd", redis_conn=None) -> Dict:
+    started = perf_counter()
+    summary = {
+        "due": 0,
+        "refreshed": 0,
+        "changed": 0,
+        "unchanged": 0,
+        "api_calls": 0,
+        "staleness_s": 0.0,
+        "wall_time_s": 0.0,
+    }
+
+    ids, summary["staleness_s"] = scheduler.select_due_coins(conn, MAX_COINS_PER_TICK)
+    summary["due"] = len(ids)
+
+    if ids:
+        update_ids, summary["api_calls"] = fetch_prices(group_ids(ids), currency)
+        changed, summary["unchanged"] = split_changed(update_ids)
+        summary["changed"] = len(changed)
+        try:
+            # One transaction per run. Only moved prices are rewritten, every fetched
+            # price still becomes a tick and the schedule stamps when it was checked.
+            if changed:
+                summary["refreshed"] = update_database(changed, conn)
+            if update_ids:
+                history.record_ticks(conn, update_ids, DB_WRITE_CHUNK_SIZE)
+            scheduler.reschedule(conn, ids)
+            conn.commit()
+        except Exception as e:
+            logging.error(f"Error during bulk update: {e}")
+            conn.rollback()
+            metrics.record_failure()
+            raise
+        last_prices.update(changed)
+        publish_prices(redis_conn, changed, currency)
     else:
-        logging.info("No rows older than 2 hours.")
+        logging.debug("No coins due for refresh.")
+        metrics.record_run(summary)
+        return summary
+
+    summary["wall_time_s"] = round(perf_counter() - started, 3)
+    logging.info(
+        f"Refresh finished: {summary['refreshed']}/{summary['due']} coins written "
+        f"({summary['changed']} changed, {summary['unchanged']} unchanged), "
+        f"{summary['api_calls']} API calls, {summary['wall_time_s']} s, "
+        f"most overdue by {summary['staleness_s']:.0f} s"
+    )
+    metrics.record_run(summary)
+    return summary
 
 
 if __name__ == "__main__":
+    conn = psycopg2.connect(DATABASE_URL)
+    redis_conn = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True) if REDIS_HOST else None
+    scheduler.ensure_schema(conn)
+    history.ensure_schema(conn)
+    metrics.start()
+    last_sync = None
+
     while True:
-        run_cron_task()
-        sleep(600)  # Sleep 10 minutes
+        try:
+            if last_sync is None or perf_counter() - last_sync >= SCHEDULE_SYNC_SECONDS:
+                scheduler.sync_schedule(conn, scheduler.recently_read_coins(redis_conn))
+                load_last_prices(conn)
+                history.ensure_partitions(conn)
+                history.apply_retention(conn)
+                last_sync = perf_counter()
+            run_cron_task(conn, redis_conn=redis_conn)
+        except psycopg2.Error as e:
+            logging.error(f"Database error during refresh: {e}")
+            conn.rollback()
+        sleep(REFRESH_TICK_SECONDS)
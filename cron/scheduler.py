@@ -0,0 +1,133 @@
+import logging
+import os
+from time import time
+from typing import List, Tuple
+
+import psycopg2
+
+# Coins held by at least this many portfolios are refreshed on the hot interval
+REFRESH_HOT_HOLDERS = int(os.getenv("REFRESH_HOT_HOLDERS", 10))
+REFRESH_HOT_SECONDS = int(os.getenv("REFRESH_HOT_SECONDS", 60))
+REFRESH_WARM_SECONDS = int(os.getenv("REFRESH_WARM_SECONDS", 600))
+# Coins without holders, 0 means they are not refreshed at all
+REFRESH_ORPHAN_SECONDS = int(os.getenv("REFRESH_ORPHAN_SECONDS", 86400))
+# Coins shown in a portfolio within this window are treated as hot
+READ_RECENT_SECONDS = int(os.getenv("READ_RECENT_SECONDS", 3600))
+
+COIN_READS_KEY = "coin_reads"
+
+SCHEDULE_DDL = """
+    CREATE TABLE IF NOT EXISTS coin_refresh_schedule (
+        coin_id_text TEXT PRIMARY KEY,
+        interval_seconds INTEGER NOT NULL,
+        next_due TIMESTAMP NOT NULL,
+        last_checked TIMESTAMP,
+        FOREIGN KEY (coin_id_text) REFERENCES coins(id_text) ON DELETE CASCADE
+    );
+    ALTER TABLE coin_refresh_schedule ADD COLUMN IF NOT EXISTS last_checked TIMESTAMP;
+    CREATE INDEX IF NOT EXISTS coin_refresh_schedule_next_due_idx ON coin_refresh_schedule (next_due);
+"""
+
+# Tier of every coin from its holder count and recent reads. New coins get a first
+# due time spread over their interval by a stable hash of the id, so they do not
+# all come due at once; existing coins keep their phase unless their tier changed.
+SYNC_SCHEDULE_QUERY = """
+    WITH tiers AS (
+        SELECT c.id_text,
+               CASE
+                   WHEN COUNT(a.user_id) >= %(hot_holders)s OR c.id_text = ANY(%(recently_read)s) THEN %(hot)s
+                   WHEN COUNT(a.user_id) > 0 THEN %(warm)s
+                   ELSE %(orphan)s
+               END AS interval_seconds
+        FROM coins c
+        LEFT JOIN user_coin_association a ON a.coin_id_text = c.id_text
+        GROUP BY c.id_text
+    ), dropped AS (
+        DELETE FROM coin_refresh_schedule s
+        USING tiers t
+        WHERE s.coin_id_text = t.id_text AND t.interval_seconds = 0
+    )
+    INSERT INTO coin_refresh_schedule (coin_id_text, interval_seconds, next_due)
+    SELECT id_text,
+           interval_seconds,
+           NOW() + make_interval(secs => (hashtext(id_text)::bigint & 2147483647) %% interval_seconds)
+    FROM tiers
+    WHERE interval_seconds > 0
+    ON CONFLICT (coin_id_text) DO UPDATE
+        SET interval_seconds = EXCLUDED.interval_seconds,
+            next_due = LEAST(coin_refresh_schedule.next_due, NOW() + make_interval(secs => EXCLUDED.interval_seconds))
+        WHERE coin_refresh_schedule.interval_seconds <> EXCLUDED.interval_seconds
+"""
+
+
+def ensure_schema(conn: psycopg2.extensions.connection):
+    with conn.cursor() as cursor:
+        cursor.execute(SCHEDULE_DDL)
+    conn.commit()
+
+
+def recently_read_coins(redis_conn) -> List[str]:
+    """
+    Coin ids shown in a portfolio within READ_RECENT_SECONDS, as recorded by the FastAPI app.
+    Older entries are trimmed. Without Redis the schedule relies on holder counts only.
+    """
+    if redis_conn is None:
+        return []
+    cutoff = time() - READ_RECENT_SECONDS
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.zremrangebyscore(COIN_READS_KEY, "-inf", cutoff)
+        pipe.zrangebyscore(COIN_READS_KEY, cutoff, "+inf")
+        return pipe.execute()[1]
+    except Exception as e:
+        logging.warning(f"Could not read recent coin reads from Redis: {e}")
+        return []
+
+
+def sync_schedule(conn: psycopg2.extensions.connection, recently_read: List[str]):
+    params = {
+        "hot_holders": REFRESH_HOT_HOLDERS,
+        "recently_read": recently_read,
+        "hot": REFRESH_HOT_SECONDS,
+        "warm": REFRESH_WARM_SECONDS,
+        "orphan": REFRESH_ORPHAN_SECONDS,
+    }
+    with conn.cursor() as cursor:
+        cursor.execute(SYNC_SCHEDULE_QUERY, params)
+        logging.info(f"Refresh schedule synced, {cursor.rowcount} coins added or moved between tiers.")
+    conn.commit()
+
+
+def select_due_coins(conn: psycopg2.extensions.connection, limit: int) -> Tuple[List[str], float]:
+    """
+    Coins whose refresh is due, most overdue first, at most `limit` per tick
+    so that the refresh load is spread evenly. Also returns how many seconds
+    the most overdue one is past its due time.
+    """
+    query = """
+        SELECT coin_id_text, EXTRACT(EPOCH FROM NOW() - next_due)
+        FROM coin_refresh_schedule
+        WHERE next_due <= NOW()
+        ORDER BY next_due
+        LIMIT %s
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(query, (limit,))
+        rows = cursor.fetchall()
+    conn.commit()
+    return [str(row[0]) for row in rows], float(rows[0][1]) if rows else 0.0
+
+
+def reschedule(conn: psycopg2.extensions.connection, coin_ids: List[str]):
+    """
+    Move the next due time of refreshed coins one interval ahead and stamp
+    when their price was last checked, whether it changed or not.
+    Runs inside the caller's transaction.
+    """
+    query = """
+        UPDATE coin_refresh_schedule
+        SET next_due = NOW() + make_interval(secs => interval_seconds), last_checked = NOW()
+        WHERE coin_id_text = ANY(%s)
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(query, (coin_ids,))
@@ -1,23 +1,104 @@
 import os
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
-import redis
+import httpx
+import redis.asyncio as redis
+from app.lib.metrics import InstrumentedRedis
 from fastapi import Depends
-from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import (AsyncSession, async_sessionmaker,
+                                    create_async_engine)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import Session, sessionmaker
 
 API_COIN_KEY = os.getenv("COINGECKO_KEY")
 API_COIN_URL = os.getenv("COINGECKO_URL")
+COINGECKO_CONNECT_TIMEOUT = float(os.getenv("COINGECKO_CONNECT_TIMEOUT", 3))
+COINGECKO_READ_TIMEOUT = float(os.getenv("COINGECKO_READ_TIMEOUT", 10))
+COINGECKO_MAX_CONNECTIONS = int(os.getenv("COINGECKO_MAX_CONNECTIONS", 20))
+# Upper bound of CoinGecko requests in flight per process
+COINGECKO_MAX_CONCURRENCY = int(os.getenv("COINGECKO_MAX_CONCURRENCY", 10))
+
+# Read-through price cache: Redis shared by all workers, in-process LRU in front of it
+PRICE_CACHE_TTL_SECONDS = int(os.getenv("PRICE_CACHE_TTL_SECONDS", 60))
+PRICE_CACHE_LOCAL_SIZE = int(os.getenv("PRICE_CACHE_LOCAL_SIZE", 1024))
+# How long one worker may hold the upstream fetch of a key before others fetch it themselves
+PRICE_CACHE_LOCK_MS = int(os.getenv("PRICE_CACHE_LOCK_MS", 5000))
+
+# Price lookups arriving within the window are merged into one simple/price call
+PRICE_BATCH_WINDOW_MS = int(os.getenv("PRICE_BATCH_WINDOW_MS", 30))
+PRICE_BATCH_MAX_IDS = int(os.getenv("PRICE_BATCH_MAX_IDS", 250))
+
+# Upper bound of operations accepted by one POST /portfolio/coins/batch
+PORTFOLIO_BATCH_MAX_OPERATIONS = int(os.getenv("PORTFOLIO_BATCH_MAX_OPERATIONS", 1000))
+
+# Price history rollups maintained by the price updater: resolution in seconds -> retention in days (0 = forever)
+HISTORY_ROLLUP_RETENTION_DAYS = {
+    60: int(os.getenv("ROLLUP_1M_RETENTION_DAYS", 30)),
+    3600: int(os.getenv("ROLLUP_1H_RETENTION_DAYS", 400)),
+    86400: int(os.getenv("ROLLUP_1D_RETENTION_DAYS", 0)),
+}
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", 1000))
+# Portfolio analytics read hourly rollups, so they cannot look further back than their retention
+HISTORY_ANALYTICS_MAX_DAYS = HISTORY_ROLLUP_RETENTION_DAYS[3600] or 365
+# Longer analytics windows read daily rollups, which keeps a year of hundreds of coins to ~200k points
+ANALYTICS_HOURLY_MAX_DAYS = int(os.getenv("ANALYTICS_HOURLY_MAX_DAYS", 90))
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Connection pool of the async engine, per worker process. pool_size + max_overflow
+# bounds the concurrent queries of a worker and should fit Postgres max_connections.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+# Seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+# Connections older than this are replaced, so server-side idle timeouts never hit a pooled one
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 REDIS_DB = int(os.getenv("REDIS_DB", 0))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+# Seconds to wait for a free pooled connection before failing
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+# Idle connections are PINGed before reuse after this many seconds
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
 
 REDIS_LOCK_KEY = "redis_data_lock"
 
+# Number of coins written per pipeline round trip when bulk loading the catalogue
+REDIS_BULK_CHUNK_SIZE = int(os.getenv("REDIS_BULK_CHUNK_SIZE", 1000))
+
+# Versioned catalogue keyspace: readers resolve keys through the current generation pointer
+CATALOGUE_CURRENT_KEY = "catalogue:current"
+CATALOGUE_SEQUENCE_KEY = "catalogue:sequence"
+# Grace period before an unpublished generation is deleted, so in-flight readers can finish
+CATALOGUE_PURGE_DELAY_SECONDS = int(os.getenv("CATALOGUE_PURGE_DELAY_SECONDS", 30))
+# Sorted set of coin ids scored by the last time a portfolio showed them, used by the refresh scheduler
+COIN_READS_KEY = "coin_reads"
+# Also store a precomputed JSON result per symbol, so a search is a single GET
+REDIS_SYMBOL_BLOBS = os.getenv("REDIS_SYMBOL_BLOBS", "false").lower() in ("1", "true", "yes")
+# How often every worker checks whether its in-memory search index is behind the current generation
+SEARCH_INDEX_CHECK_SECONDS = int(os.getenv("SEARCH_INDEX_CHECK_SECONDS", 10))
+# Periodic catalogue refresh, 0 disables it
+CATALOGUE_REFRESH_SECONDS = int(os.getenv("CATALOGUE_REFRESH_SECONDS", 0))
+# Held by the worker running a periodic refresh; expires if that worker dies mid-load
+CATALOGUE_REFRESH_LOCK_KEY = "catalogue:refresh_lock"
+CATALOGUE_REFRESH_LOCK_SECONDS = int(os.getenv("CATALOGUE_REFRESH_LOCK_SECONDS", 600))
+
+# Pub/sub channel the price updater publishes refreshed prices to
+PRICE_CHANNEL = os.getenv("PRICE_CHANNEL", "prices")
+# Idle price streams send a heartbeat this often, which also detects closed clients
+PRICE_STREAM_HEARTBEAT_SECONDS = int(os.getenv("PRICE_STREAM_HEARTBEAT_SECONDS", 15))
+# Incremented by the price updater whenever it writes prices, part of the portfolio ETag
+PRICES_VERSION_KEY = "prices:version"
+
+# Serialized search responses kept per worker, and the size from which they are compressed
+SEARCH_RESPONSE_CACHE_SIZE = int(os.getenv("SEARCH_RESPONSE_CACHE_SIZE", 5000))
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", 1024))
+# Users whose last portfolio ETag and coin ids are remembered per worker, so 304s still count as reads
+SERVED_PORTFOLIOS_CACHE_SIZE = int(os.getenv("SERVED_PORTFOLIOS_CACHE_SIZE", 10000))
+
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 
@@ -25,45 +106,170 @@ API_KEY = os.getenv("API_KEY", "default_secret_key")
 
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 20))
 
+# Authenticated users are cached per token subject for this long, 0 disables the cache
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 30))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", 10000))
+
+# bcrypt runs on this many threads per process; once this many checks are queued
+# or running, further logins and registrations get 503 with Retry-After
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 32))
+PASSWORD_HASH_RETRY_AFTER_SECONDS = int(os.getenv("PASSWORD_HASH_RETRY_AFTER_SECONDS", 2))
+
+# Requests carrying PROFILE_HEADER set to API_KEY are profiled, and this share of all other requests
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+# Profile reports are kept in Redis for this long, the most recent ones are listed by /internal/profiles
+PROFILE_REPORT_TTL_SECONDS = int(os.getenv("PROFILE_REPORT_TTL_SECONDS", 86400))
+PROFILE_RECENT_REPORTS = int(os.getenv("PROFILE_RECENT_REPORTS", 100))
+PROFILE_TOP_QUERIES = int(os.getenv("PROFILE_TOP_QUERIES", 5))
+# Requests slower than this are logged with their span breakdown and top queries, 0 disables the log
+SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", 1000))
+# A callback holding the event loop longer than this is logged with its stack, 0 disables the watchdog
+LOOP_BLOCK_THRESHOLD_MS = int(os.getenv("LOOP_BLOCK_THRESHOLD_MS", 100))
+
 # Ensure DATABASE_URL is set
 if not SQLALCHEMY_DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set")
 
-# Create SQLAlchemy engine and session factory
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def _async_database_url(url: str):
+    # DATABASE_URL is shared with the cron job, which uses psycopg2
+    database_url = make_url(url)
+    if database_url.drivername in ("postgresql", "postgres", "postgresql+psycopg2"):
+        database_url = database_url.set(drivername="postgresql+asyncpg")
+    return database_url
+
+
+# Create SQLAlchemy async engine and session factory
+engine = create_async_engine(
+    _async_database_url(SQLALCHEMY_DATABASE_URL),
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+# Objects stay usable after commit without another round trip to reload them
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 
 # Create declarative base for SQLAlchemy models
 Base = declarative_base()
 
+# Process-wide Redis and HTTP clients, created at startup and closed at shutdown
+redis_client: redis.Redis | None = None
+http_client: httpx.AsyncClient | None = None
+
+
+def init_redis_pool() -> redis.Redis:
+    """
+    Create the shared Redis connection pool and client.
+    """
+    global redis_client
+    if redis_client is None:
+        pool = redis.BlockingConnectionPool(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            db=REDIS_DB,
+            decode_responses=True,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        )
+        redis_client = InstrumentedRedis(connection_pool=pool)
+    return redis_client
+
+
+async def close_redis_pool():
+    """
+    Close the shared Redis client and disconnect all pooled connections.
+    """
+    global redis_client
+    if redis_client is not None:
+        await redis_client.aclose(close_connection_pool=True)
+        redis_client = None
+
+
+def init_http_client() -> httpx.AsyncClient:
+    """
+    Create the shared keep-alive HTTP client for CoinGecko.
+    HTTP/2 is used when the optional h2 package is installed.
+    """
+    global http_client
+    if http_client is None:
+        try:
+            import h2  # noqa: F401
+
+            http2 = True
+        except ImportError:
+            http2 = False
+
+        http_client = httpx.AsyncClient(
+            base_url=API_COIN_URL or "",
+            headers={"x-cg-api-key": API_COIN_KEY or ""},
+            http2=http2,
+            timeout=httpx.Timeout(COINGECKO_READ_TIMEOUT, connect=COINGECKO_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=COINGECKO_MAX_CONNECTIONS,
+                max_keepalive_connections=COINGECKO_MAX_CONNECTIONS,
+            ),
+        )
+    return http_client
+
+
+async def close_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    return http_client or init_http_client()
+
+
+async def close_db_engine():
+    """
+    Close all pooled database connections.
+    """
+    await engine.dispose()
+
+
+def get_db_pool_stats() -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_connections": DB_POOL_SIZE + DB_MAX_OVERFLOW,
+    }
+
 
-def get_db_session() -> Generator:
+async def get_db_session() -> AsyncGenerator:
     """
-    Dependency to provide a SQLAlchemy session.
+    Dependency to provide a SQLAlchemy async session.
     Automatically closes the session after the request.
     """
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-def get_redis_connection() -> redis.StrictRedis:
+def get_redis_connection() -> redis.Redis:
     """
-    Dependency to provide a Redis connection.
+    Dependency to provide the shared Redis client.
     """
-    return redis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True)
+    return redis_client or init_redis_pool()
 
 
-def get_db(db: Session = Depends(get_db_session)) -> Generator:
+async def get_db(db: AsyncSession = Depends(get_db_session)) -> AsyncGenerator:
     """
     Dependency for using the database session within FastAPI endpoints.
     """
     yield db
 
 
-def get_redis(redis_conn: redis.StrictRedis = Depends(get_redis_connection)) -> Generator:
+def get_redis(redis_conn: redis.Redis = Depends(get_redis_connection)) -> Generator:
     """
     Dependency for using the Redis connection within FastAPI endpoints.
     """
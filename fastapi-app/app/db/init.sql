@@ -20,4 +20,39 @@ CREATE TABLE user_coin_association (
     PRIMARY KEY (user_id, coin_id_text),
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     FOREIGN KEY (coin_id_text) REFERENCES coins(id_text) ON DELETE CASCADE
-);
\ No newline at end of file
+);
+
+-- Next refresh time of every tracked coin, maintained by the price updater.
+CREATE TABLE coin_refresh_schedule (
+    coin_id_text TEXT PRIMARY KEY,
+    interval_seconds INTEGER NOT NULL,
+    next_due TIMESTAMP NOT NULL,
+    -- Last time the price was fetched; coins.last_updated only moves when it changed
+    last_checked TIMESTAMP,
+    FOREIGN KEY (coin_id_text) REFERENCES coins(id_text) ON DELETE CASCADE
+);
+
+CREATE INDEX coin_refresh_schedule_next_due_idx ON coin_refresh_schedule (next_due);
+
+
+-- Append-only price history written by the price updater.
+-- Partitioned by day, so the retention policy drops whole partitions.
+CREATE TABLE price_ticks (
+    coin_id_text TEXT NOT NULL,
+    ts TIMESTAMP NOT NULL,
+    price NUMERIC NOT NULL
+) PARTITION BY RANGE (ts);
+
+CREATE INDEX price_ticks_coin_ts_idx ON price_ticks (coin_id_text, ts);
+
+-- OHLC rollups of price_ticks, resolution is the bucket width in seconds (60, 3600, 86400).
+CREATE TABLE price_rollups (
+    coin_id_text TEXT NOT NULL,
+    resolution INTEGER NOT NULL,
+    bucket TIMESTAMP NOT NULL,
+    open NUMERIC NOT NULL,
+    high NUMERIC NOT NULL,
+    low NUMERIC NOT NULL,
+    close NUMERIC NOT NULL,
+    PRIMARY KEY (coin_id_text, resolution, bucket)
+);
@@ -1,13 +1,13 @@
 from app.config import Base
-from sqlalchemy import (Column, ForeignKey, Integer, Numeric, String, Table,
-                        Text)
-from sqlalchemy.orm import relationship
+from sqlalchemy import (Column, DateTime, ForeignKey, Integer, Numeric, String,
+                        Table, Text, func)
+from sqlalchemy.orm import deferred, relationship
 
 user_coin_association = Table(
     "user_coin_association",
     Base.metadata,
     Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
-    Column("coin_id_text", Integer, ForeignKey("coins.id_text"), primary_key=True),
+    Column("coin_id_text", Text, ForeignKey("coins.id_text"), primary_key=True),
 )
 
 
@@ -39,5 +39,19 @@ class Coin(Base):
     symbol = Column(Text, index=True)
     name = Column(Text)
     price = Column(Numeric)
+    # Moved by the price updater with every price it writes. Deferred, so it stays out of portfolio responses
+    last_updated = deferred(Column(DateTime, server_default=func.now()))
 
     users = relationship("User", secondary=user_coin_association, back_populates="coins")
+
+
+class PriceRollup(Base):
+    __tablename__ = "price_rollups"
+
+    coin_id_text = Column(Text, primary_key=True)
+    resolution = Column(Integer, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    open = Column(Numeric)
+    high = Column(Numeric)
+    low = Column(Numeric)
+    close = Column(Numeric)
@@ -0,0 +1,197 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from itertools import chain
+
+import app.config as config
+import numpy as np
+from app.db.schema import Coin, PriceRollup, user_coin_association
+from sqlalchemy import BigInteger, Float, cast, func, select
+from sqlalchemy.dialects.postgresql import array_agg
+
+HOURLY = 3600
+DAILY = 86400
+SECONDS_PER_YEAR = 365 * DAILY
+# Rollup buckets are naive UTC timestamps
+EPOCH = datetime(1970, 1, 1)
+
+
+def align_closes(
+    coin_indexes: np.ndarray, bucket_indexes: np.ndarray, closes: np.ndarray, n_coins: int, n_buckets: int
+):
+    """
+    Scatter (coin, bucket, close) triples into a coins x buckets matrix and
+    forward-fill gaps along the time axis. Buckets before a coin's first
+    close stay NaN. Returns the filled matrix and the mask of observed cells.
+    """
+    matrix = np.full((n_coins, n_buckets), np.nan)
+    matrix[coin_indexes, bucket_indexes] = closes
+    observed = ~np.isnan(matrix)
+
+    positions = np.where(observed, np.arange(n_buckets), 0)
+    np.maximum.accumulate(positions, axis=1, out=positions)
+    return matrix[np.arange(n_coins)[:, None], positions], observed
+
+
+def _change(closes: np.ndarray, hours: int) -> np.ndarray:
+    if closes.shape[1] <= hours:
+        return np.full(closes.shape[0], np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return closes[:, -1] / closes[:, -1 - hours] - 1
+
+
+def pairwise_correlation(returns: np.ndarray) -> np.ndarray:
+    """
+    Pearson correlation of every pair of rows over the hours where both are
+    defined, computed with matrix products instead of a loop over pairs.
+    """
+    valid = np.isfinite(returns).astype(float)
+    x = np.where(valid > 0, returns, 0.0)
+
+    n = valid @ valid.T
+    sum_x = x @ valid.T
+    sum_xx = (x * x) @ valid.T
+    sum_xy = x @ x.T
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = sum_xy - sum_x * sum_x.T / n
+        var_x = sum_xx - sum_x**2 / n
+        var_y = sum_xx.T - sum_x.T**2 / n
+        corr = cov / np.sqrt(var_x * var_y)
+    corr[n < 2] = np.nan
+    return np.clip(corr, -1.0, 1.0)
+
+
+def compute_analytics(prices: np.ndarray, closes: np.ndarray, observed=None, resolution: int = HOURLY) -> dict:
+    """
+    Portfolio metrics from current prices (one unit per holding) and an
+    aligned coins x buckets matrix of closes, `resolution` seconds apart.
+    Returns touching a bucket that is not in `observed` are left out: a
+    forward-filled gap is a missing move, not a move of zero.
+    """
+    total_value = float(prices.sum())
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = prices / total_value
+        returns = np.diff(np.log(closes), axis=1)
+    if observed is not None:
+        returns[~(observed[:, 1:] & observed[:, :-1])] = np.nan
+
+    if returns.shape[1]:
+        valid = np.isfinite(returns)
+        counts = valid.sum(axis=1)
+        mean = np.where(valid, returns, 0).sum(axis=1) / np.maximum(counts, 1)
+        variance = np.where(valid, (returns - mean[:, None]) ** 2, 0).sum(axis=1) / np.maximum(counts - 1, 1)
+        volatility = np.where(counts > 1, np.sqrt(variance * SECONDS_PER_YEAR / resolution), np.nan)
+    else:
+        volatility = np.full(len(prices), np.nan)
+
+    return {
+        "total_value": total_value,
+        "weights": weights,
+        # From daily rollups these are the changes since the previous daily closes
+        "change_24h": _change(closes, DAILY // resolution),
+        "change_7d": _change(closes, 7 * DAILY // resolution),
+        "volatility": volatility,
+        "correlation": pairwise_correlation(returns),
+    }
+
+
+def _finite_or_none(values: np.ndarray) -> list:
+    # Works on matrices too, giving nested lists
+    return np.where(np.isfinite(values), values, None).tolist()
+
+
+async def load_closes(db, coin_ids, start: datetime, resolution: int):
+    """
+    Closes of the coins since `start`, as one row per coin holding the bucket
+    times (epoch seconds) and closes in two arrays, instead of a row, a
+    datetime and a Decimal per point.
+    """
+    statement = (
+        select(
+            PriceRollup.coin_id_text,
+            array_agg(cast(func.extract("epoch", PriceRollup.bucket), BigInteger)),
+            array_agg(cast(PriceRollup.close, Float)),
+        )
+        .where(
+            PriceRollup.coin_id_text.in_(coin_ids),
+            PriceRollup.resolution == resolution,
+            PriceRollup.bucket >= start,
+        )
+        .group_by(PriceRollup.coin_id_text)
+    )
+    return (await db.execute(statement)).all()
+
+
+def build_analytics(holdings, series, start_seconds: int, n_buckets: int, resolution: int) -> dict:
+    """
+    Response of get_portfolio_analytics from the holdings and the rows of
+    load_closes. CPU bound, run it in a thread.
+    """
+    ids = [holding.id_text for holding in holdings]
+    positions = {coin_id: i for i, coin_id in enumerate(ids)}
+    lengths = [len(closes) for _, _, closes in series]
+    count = sum(lengths)
+
+    coin_indexes = np.repeat(np.array([positions[coin_id] for coin_id, _, _ in series], dtype=np.intp), lengths)
+    bucket_seconds = np.fromiter(chain.from_iterable(buckets for _, buckets, _ in series), dtype=np.int64, count=count)
+    closes = np.fromiter(chain.from_iterable(closes for _, _, closes in series), dtype=float, count=count)
+    bucket_indexes = (bucket_seconds - start_seconds) // resolution
+    in_range = bucket_indexes < n_buckets
+    matrix, observed = align_closes(
+        coin_indexes[in_range], bucket_indexes[in_range], closes[in_range], len(ids), n_buckets
+    )
+
+    prices = np.array([float(holding.price or 0) for holding in holdings])
+    metrics = compute_analytics(prices, matrix, observed, resolution)
+
+    weights = _finite_or_none(metrics["weights"])
+    change_24h = _finite_or_none(metrics["change_24h"])
+    change_7d = _finite_or_none(metrics["change_7d"])
+    volatility = _finite_or_none(metrics["volatility"])
+
+    return {
+        "total_value": metrics["total_value"],
+        "holdings": [
+            {
+                "id_text": holding.id_text,
+                "symbol": holding.symbol,
+                "name": holding.name,
+                "price": float(holding.price or 0),
+                "weight": weights[i],
+                "change_24h": change_24h[i],
+                "change_7d": change_7d[i],
+                "volatility": volatility[i],
+            }
+            for i, holding in enumerate(holdings)
+        ],
+        "correlation": {"ids": ids, "matrix": _finite_or_none(metrics["correlation"])},
+    }
+
+
+async def get_portfolio_analytics(db, user_id: int, days: int) -> dict:
+    """
+    Windows up to ANALYTICS_HOURLY_MAX_DAYS read hourly rollups, longer ones
+    daily rollups. The numeric work runs in a thread so it does not stall the
+    event loop.
+    """
+    holdings = (
+        await db.execute(
+            select(Coin.id_text, Coin.symbol, Coin.name, Coin.price)
+            .join(user_coin_association, user_coin_association.c.coin_id_text == Coin.id_text)
+            .where(user_coin_association.c.user_id == user_id)
+            .order_by(Coin.id_text)
+        )
+    ).all()
+    if not holdings:
+        return {"total_value": 0.0, "holdings": [], "correlation": {"ids": [], "matrix": []}}
+
+    resolution = HOURLY if days <= config.ANALYTICS_HOURLY_MAX_DAYS else DAILY
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    end_seconds = int((now - EPOCH).total_seconds()) // resolution * resolution
+    start_seconds = end_seconds - days * DAILY
+    n_buckets = days * DAILY // resolution + 1
+
+    series = await load_closes(
+        db, [holding.id_text for holding in holdings], EPOCH + timedelta(seconds=start_seconds), resolution
+    )
+    return await asyncio.to_thread(build_analytics, holdings, series, start_seconds, n_buckets, resolution)
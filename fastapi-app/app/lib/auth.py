@@ -1,9 +1,15 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from time import monotonic, perf_counter
 from typing import Annotated
 
+import app.config as config
 import jwt
 from app.config import ALGORITHM, API_KEY, SECRET_KEY, get_db
 from app.db.schema import User
+from app.lib.metrics import record_span
 from app.models.token import TokenData
 from app.models.user import UserInDB, UserResponse
 from fastapi import Depends, HTTPException, Request, Security, status
@@ -11,7 +17,9 @@ from fastapi.security import OAuth2PasswordBearer, SecurityScopes
 from jwt.exceptions import InvalidTokenError
 from passlib.context import CryptContext
 from pydantic import ValidationError
-from sqlalchemy.orm import Session
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 
 oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl="token",
@@ -20,6 +28,13 @@ oauth2_scheme = OAuth2PasswordBearer(
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# email -> (expires_at, detached User), most recently used last
+_principal_cache = OrderedDict()
+
+# bcrypt releases the GIL, so a small thread pool keeps it off the event loop
+_password_pool = None
+_password_jobs = 0
+
 
 # Function for verify cron api key (aut. change price)
 def verify_api_key(request: Request):
@@ -28,16 +43,48 @@ def verify_api_key(request: Request):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden: Invalid API Key")
 
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def _run_password_job(func, *args):
+    """
+    Run a bcrypt call on the password pool. Rejects the request with 503 when
+    PASSWORD_HASH_MAX_PENDING calls are already queued or running, so a login
+    storm cannot pile up behind the pool.
+    """
+    global _password_pool, _password_jobs
+    if _password_jobs >= config.PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent authentication requests",
+            headers={"Retry-After": str(config.PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+        )
+    if _password_pool is None:
+        _password_pool = ThreadPoolExecutor(max_workers=config.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+    _password_jobs += 1
+    started = perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_password_pool, func, *args)
+    finally:
+        _password_jobs -= 1
+        record_span("password_hash", perf_counter() - started)
+
+
+def shutdown_password_pool():
+    global _password_pool
+    if _password_pool is not None:
+        _password_pool.shutdown(wait=False, cancel_futures=True)
+        _password_pool = None
+
+
+async def get_password_hash(password: str) -> str:
+    return await _run_password_job(pwd_context.hash, password)
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await _run_password_job(pwd_context.verify, plain_password, hashed_password)
 
 
-def get_user(db, email: str, no_passwd: bool = True):
-    db_user = db.query(User).filter(User.email == email).first()
+async def get_user(db, email: str, no_passwd: bool = True):
+    db_user = (await db.execute(select(User).where(User.email == email))).scalars().first()
     if db_user:
         if no_passwd:
             return db_user
@@ -45,11 +92,52 @@ def get_user(db, email: str, no_passwd: bool = True):
             return UserInDB(**db_user.to_dict(include_password=True))
 
 
-def authenticate_user(db, username: str, password: str):
-    user = get_user(db, username, no_passwd=False)
+def get_cached_principal(email: str):
+    entry = _principal_cache.get(email)
+    if entry is None:
+        return None
+    expires_at, principal = entry
+    if expires_at <= monotonic():
+        _principal_cache.pop(email, None)
+        return None
+    _principal_cache.move_to_end(email)
+    return principal
+
+
+def cache_principal(db_user: User) -> User:
+    """
+    Cache a detached copy of the user holding only its id and email,
+    which is all handlers need to scope their queries.
+    """
+    principal = User(id=db_user.id, email=db_user.email)
+    make_transient_to_detached(principal)
+
+    if config.PRINCIPAL_CACHE_TTL_SECONDS > 0:
+        _principal_cache[db_user.email] = (monotonic() + config.PRINCIPAL_CACHE_TTL_SECONDS, principal)
+        _principal_cache.move_to_end(db_user.email)
+        while len(_principal_cache) > config.PRINCIPAL_CACHE_SIZE:
+            _principal_cache.popitem(last=False)
+    return principal
+
+
+def invalidate_principal(email: str):
+    _principal_cache.pop(email, None)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    # Also drop the previous email when it has been changed
+    for email in inspect(target).attrs.email.history.deleted or ():
+        invalidate_principal(email)
+    invalidate_principal(target.email)
+
+
+async def authenticate_user(db, username: str, password: str):
+    user = await get_user(db, username, no_passwd=False)
     if not user:
         return False
-    if not verify_password(password, user.password):
+    if not await verify_password(password, user.password):
         return False
     return user
 
@@ -65,13 +153,13 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-async def get_current_user(
-    security_scopes: SecurityScopes,
-    token: Annotated[str, Depends(oauth2_scheme)],
-    db: Session = Depends(get_db),
-):
-    if security_scopes.scopes:
-        authenticate_value = f'Bearer scope="{security_scopes.scope_str}"'
+async def resolve_principal(token: str, db, scopes=()):
+    """
+    Validate a bearer token and return the user it belongs to, raising 401 otherwise.
+    Also used by the WebSocket endpoints, where OAuth2PasswordBearer does not apply.
+    """
+    if scopes:
+        authenticate_value = f'Bearer scope="{" ".join(scopes)}"'
     else:
         authenticate_value = "Bearer"
     credentials_exception = HTTPException(
@@ -88,10 +176,13 @@ async def get_current_user(
         token_data = TokenData(scopes=token_scopes, email=email)
     except (InvalidTokenError, ValidationError):
         raise credentials_exception
-    user = get_user(db, email=token_data.email)
+    user = get_cached_principal(token_data.email)
     if user is None:
-        raise credentials_exception
-    for scope in security_scopes.scopes:
+        db_user = await get_user(db, email=token_data.email)
+        if db_user is None:
+            raise credentials_exception
+        user = cache_principal(db_user)
+    for scope in scopes:
         if scope not in token_data.scopes:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -101,6 +192,14 @@ async def get_current_user(
     return user
 
 
+async def get_current_user(
+    security_scopes: SecurityScopes,
+    token: Annotated[str, Depends(oauth2_scheme)],
+    db: AsyncSession = Depends(get_db),
+):
+    return await resolve_principal(token, db, security_scopes.scopes)
+
+
 async def get_current_active_user(
     current_user: Annotated[UserResponse, Security(get_current_user)],
 ):
@@ -1,22 +1,25 @@
+import asyncio
 import json
 import logging
+from time import perf_counter
 
-import requests
-from app.config import API_COIN_KEY, API_COIN_URL
+import app.config as config
+import httpx
+from app.lib.metrics import COINGECKO_REQUEST_DURATION, record_span
 
 
 async def get_coin_data_by_symbol(symbol, redis_conn):
     symbol_key = f"symbol:{symbol}"
 
-    coin_ids = redis_conn.lrange(symbol_key, 0, -1)
+    coin_ids = await redis_conn.lrange(symbol_key, 0, -1)
 
     coins = []
     for coin_id in coin_ids:
         coin_key = f"{coin_id}"
-        coin_data = json.loads(redis_conn.get(coin_key))
+        coin_data = json.loads(await redis_conn.get(coin_key))
 
         if coin_data:
-            print(f"Načítám coin {coin_id}: {coin_data}")
+            logging.debug(f"Načítám coin {coin_id}: {coin_data}")
             coin_data["coin_id"] = coin_id
             coins.append(coin_data)
     return coins
@@ -24,15 +27,29 @@ async def get_coin_data_by_symbol(symbol, redis_conn):
 
 logging.basicConfig(level=logging.INFO)
 
+# Bounds the CoinGecko requests in flight so a burst cannot exhaust the API quota
+_coingecko_slots = asyncio.Semaphore(config.COINGECKO_MAX_CONCURRENCY)
 
-async def get_coin_price(coin_ids_text, currency="usd"):
-    url = API_COIN_URL + "simple/price?ids=" + coin_ids_text + "&vs_currencies=" + currency
-    payload = {}
-    headers = {"x-cg-api-key": API_COIN_KEY}
 
-    response = requests.request("GET", url, headers=headers, data=payload)
+async def _coingecko_get(path, params=None):
+    client = config.get_http_client()
+    async with _coingecko_slots:
+        status = "error"
+        started = perf_counter()
+        try:
+            response = await client.get(path, params=params)
+            status = str(response.status_code)
+            return response
+        finally:
+            elapsed = perf_counter() - started
+            COINGECKO_REQUEST_DURATION.labels(path, status).observe(elapsed)
+            record_span("coingecko", elapsed)
+
 
+async def get_coin_price(coin_ids_text, currency="usd"):
     try:
+        response = await _coingecko_get("simple/price", params={"ids": coin_ids_text, "vs_currencies": currency})
+
         if response.status_code == 200:
             try:
                 # Try extract data
@@ -50,25 +67,21 @@ async def get_coin_price(coin_ids_text, currency="usd"):
         else:
             logging.error(f"Failed to fetch data. Status code: {response.status_code}, Response: {response.text}")
             return {}
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logging.error("Request timeout")
         return {}
-    except requests.exceptions.TooManyRedirects:
+    except httpx.TooManyRedirects:
         logging.error("Too many redirects")
         return {}
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logging.error(f"Request failed: {e}")
         return {}
 
 
 async def download_coins_list_data():
-    url = API_COIN_URL + "coins/list"
-    payload = {}
-    headers = {"x-cg-api-key": API_COIN_KEY}
-
-    response = requests.request("GET", url, headers=headers, data=payload)
-
     try:
+        response = await _coingecko_get("coins/list")
+
         if response.status_code == 200:
             try:
                 response_json = response.json()
@@ -86,12 +99,12 @@ async def download_coins_list_data():
         else:
             logging.error(f"Failed to fetch data. Status code: {response.status_code}, Response: {response.text}")
             return []
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logging.error("Request timeout")
         return []
-    except requests.exceptions.TooManyRedirects:
+    except httpx.TooManyRedirects:
         logging.error("Too many redirects")
         return []
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logging.error(f"Request failed: {e}")
         return []
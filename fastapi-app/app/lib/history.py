@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta, timezone
+
+import app.config as config
+from app.db.schema import PriceRollup
+from app.models.coin import PriceHistory, PricePoint
+from sqlalchemy import select
+
+
+def to_utc_naive(value: datetime) -> datetime:
+    # Rollups are stored as naive UTC timestamps, naive input is taken as UTC
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def pick_resolution(start: datetime, end: datetime, max_points: int, now: datetime) -> int:
+    """
+    Smallest rollup resolution that still covers `start` and returns at most `max_points` buckets.
+    """
+    resolutions = sorted(config.HISTORY_ROLLUP_RETENTION_DAYS.items())
+    for resolution, retention_days in resolutions:
+        if retention_days and start < now - timedelta(days=retention_days):
+            continue
+        if (end - start).total_seconds() / resolution <= max_points:
+            return resolution
+    return resolutions[-1][0]
+
+
+async def get_price_history(db, coin_id: str, start: datetime, end: datetime, max_points: int) -> PriceHistory:
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    start, end = to_utc_naive(start), to_utc_naive(end)
+    resolution = pick_resolution(start, end, max_points, now)
+
+    statement = (
+        select(PriceRollup.bucket, PriceRollup.open, PriceRollup.high, PriceRollup.low, PriceRollup.close)
+        .where(
+            PriceRollup.coin_id_text == coin_id,
+            PriceRollup.resolution == resolution,
+            # Include the bucket that contains start
+            PriceRollup.bucket > start - timedelta(seconds=resolution),
+            PriceRollup.bucket <= end,
+        )
+        .order_by(PriceRollup.bucket)
+    )
+    rows = (await db.execute(statement)).all()
+
+    return PriceHistory(
+        id_text=coin_id,
+        resolution=resolution,
+        points=[
+            PricePoint(bucket=bucket, open=open, high=high, low=low, close=close)
+            for bucket, open, high, low, close in rows
+        ],
+    )
@@ -0,0 +1,213 @@
+import hashlib
+
+from app.db.schema import Coin, user_coin_association
+from app.lib.price_cache import get_cached_prices
+from app.lib.redis import get_coins_by_ids
+from sqlalchemy import delete, func, literal, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert
+
+# Set-based statements against user_coin_association. Each one is a single
+# round trip whose cost does not depend on how many coins the user holds.
+
+
+async def get_holdings(db, user_id: int):
+    """
+    Coins of the user's portfolio, read with one joined SELECT.
+    """
+    statement = (
+        select(Coin)
+        .join(user_coin_association, user_coin_association.c.coin_id_text == Coin.id_text)
+        .where(user_coin_association.c.user_id == user_id)
+        .order_by(Coin.id_text)
+    )
+    return (await db.execute(statement)).scalars().all()
+
+
+async def holdings_fingerprint(db, user_id: int) -> str:
+    """
+    Short digest of what the portfolio response is made of: which coins the user
+    holds and when their prices last moved. Read with one aggregate query.
+    """
+    coin_id = user_coin_association.c.coin_id_text
+    statement = (
+        select(
+            func.count(),
+            func.max(Coin.last_updated),
+            func.md5(func.string_agg(coin_id, aggregate_order_by(literal_column("','"), coin_id))),
+        )
+        .join(Coin, Coin.id_text == coin_id)
+        .where(user_coin_association.c.user_id == user_id)
+    )
+    count, last_updated, coin_ids_md5 = (await db.execute(statement)).one()
+    return hashlib.blake2b(f"{count}|{last_updated}|{coin_ids_md5}".encode(), digest_size=8).hexdigest()
+
+
+async def add_holding(db, user_id: int, coin_id: str) -> bool:
+    """
+    Link an already stored coin to the user. Returns False when nothing was inserted,
+    i.e. the coin is unknown or already held; coin_exists() tells the two apart.
+    """
+    statement = (
+        insert(user_coin_association)
+        .from_select(
+            ["user_id", "coin_id_text"],
+            select(literal(user_id), Coin.id_text).where(Coin.id_text == coin_id),
+        )
+        .on_conflict_do_nothing()
+        .returning(user_coin_association.c.coin_id_text)
+    )
+    return (await db.execute(statement)).first() is not None
+
+
+async def remove_holding(db, user_id: int, coin_id: str) -> bool:
+    """
+    Unlink a coin from the user. Returns False when the user did not hold it.
+    """
+    statement = (
+        delete(user_coin_association)
+        .where(
+            user_coin_association.c.user_id == user_id,
+            user_coin_association.c.coin_id_text == coin_id,
+        )
+        .returning(user_coin_association.c.coin_id_text)
+    )
+    return (await db.execute(statement)).first() is not None
+
+
+async def coin_exists(db, coin_id: str) -> bool:
+    return (await db.execute(select(Coin.id_text).where(Coin.id_text == coin_id))).first() is not None
+
+
+def _simulate(operations, held, stored, catalogue, prices):
+    """
+    Replay the operations against the set of held coin ids, in order.
+    Failed operations are reported and skipped, they do not stop the batch.
+    A coin that is not stored yet can only be added once it has a price.
+    """
+
+    def known(coin_id):
+        return coin_id in stored or coin_id in catalogue
+
+    def unpriced(coin_id):
+        return coin_id not in stored and coin_id not in prices
+
+    results = []
+    for operation in operations:
+        status, detail = 200, "ok"
+        if operation.op == "add":
+            if operation.id_text in held:
+                status, detail = 409, "Coin already assigned to this user"
+            elif not known(operation.id_text):
+                status, detail = 404, "Coin data not found"
+            elif unpriced(operation.id_text):
+                status, detail = 500, "Unable to fetch coin price"
+            else:
+                held.add(operation.id_text)
+
+        elif operation.op == "remove":
+            if operation.id_text not in held:
+                if operation.id_text not in stored:
+                    status, detail = 404, "Coin not found"
+                else:
+                    status, detail = 400, "Coin is not in user's portfolio"
+            else:
+                held.discard(operation.id_text)
+
+        else:
+            if not operation.to_id_text:
+                status, detail = 400, "to_id_text is required for replace"
+            elif operation.id_text not in held:
+                if operation.id_text not in stored:
+                    status, detail = 404, "Actual coin not found"
+                else:
+                    status, detail = 404, "Actual coin data not assigned to portfolio"
+            elif operation.to_id_text in held and operation.to_id_text != operation.id_text:
+                status, detail = 409, "Coin already assigned to this user"
+            elif not known(operation.to_id_text):
+                status, detail = 404, "Coin data not found"
+            elif unpriced(operation.to_id_text):
+                status, detail = 500, "Unable to fetch coin price"
+            else:
+                held.discard(operation.id_text)
+                held.add(operation.to_id_text)
+
+        results.append(
+            {
+                "op": operation.op,
+                "id_text": operation.id_text,
+                "to_id_text": operation.to_id_text,
+                "status": status,
+                "detail": detail,
+            }
+        )
+    return results
+
+
+async def apply_operations(db, user_id: int, operations, redis_conn, currency: str = "usd") -> dict:
+    """
+    Apply a list of add/remove/replace operations to the user's portfolio.
+
+    The current holdings and the stored coins are read once, coins missing
+    from the database are resolved with one Redis pipeline and priced through
+    the price cache, so only uncached prices reach CoinGecko. Adding a coin
+    without a price fails like update_coin does. The net change is then
+    written with one statement per kind; the caller commits.
+    """
+    referenced = {operation.id_text for operation in operations}
+    referenced |= {operation.to_id_text for operation in operations if operation.to_id_text}
+
+    initial = set(
+        (
+            await db.execute(
+                select(user_coin_association.c.coin_id_text).where(user_coin_association.c.user_id == user_id)
+            )
+        ).scalars()
+    )
+    stored = set((await db.execute(select(Coin.id_text).where(Coin.id_text.in_(referenced)))).scalars())
+
+    targets = {
+        operation.to_id_text if operation.op == "replace" else operation.id_text
+        for operation in operations
+        if operation.op != "remove"
+    }
+    targets.discard(None)
+    catalogue = await get_coins_by_ids(sorted(targets - stored), redis_conn)
+    prices = await get_cached_prices(sorted(catalogue), redis_conn, currency) if catalogue else {}
+
+    held = set(initial)
+    results = _simulate(operations, held, stored, catalogue, prices)
+
+    added, removed = held - initial, initial - held
+    new_coins = sorted(added - stored)
+    if new_coins:
+        await db.execute(
+            insert(Coin)
+            .values(
+                [
+                    {
+                        "id_text": coin_id,
+                        "symbol": catalogue[coin_id].get("symbol"),
+                        "name": catalogue[coin_id].get("name"),
+                        "price": prices[coin_id],
+                    }
+                    for coin_id in new_coins
+                ]
+            )
+            .on_conflict_do_nothing()
+        )
+
+    if removed:
+        await db.execute(
+            delete(user_coin_association).where(
+                user_coin_association.c.user_id == user_id,
+                user_coin_association.c.coin_id_text.in_(sorted(removed)),
+            )
+        )
+    if added:
+        await db.execute(
+            insert(user_coin_association)
+            .values([{"user_id": user_id, "coin_id_text": coin_id} for coin_id in sorted(added)])
+            .on_conflict_do_nothing()
+        )
+
+    return {"applied": sum(result["status"] == 200 for result in results), "results": results}
@@ -0,0 +1,136 @@
+import gzip
+import json
+import logging
+from collections import OrderedDict
+
+import app.config as config
+from fastapi import Request, Response
+from redis.exceptions import RedisError
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# (generation, symbol) -> (json body, {encoding: compressed body}), most recently used last
+_search_bodies = OrderedDict()
+# user_id -> (etag, coin ids) of the last portfolio served by this worker, so 304
+# responses can still be recorded as reads for the refresh scheduler
+_served_portfolios = OrderedDict()
+
+_stats = {"search_hits": 0, "search_misses": 0, "not_modified": 0}
+
+
+def portfolio_version_key(user_id):
+    return f"portfolio_version:{user_id}"
+
+
+def get_stats():
+    return {**_stats, "search_entries": len(_search_bodies), "portfolios": len(_served_portfolios)}
+
+
+def _remember(cache, key, value, max_size):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
+
+async def bump_portfolio_version(user_id, redis_conn):
+    """
+    Invalidate the ETag of the user's portfolio after it changed. Runs after
+    the commit, so a failure does not fail the request: the version is dropped
+    instead, and the database fingerprint in the ETag still tells the contents apart.
+    """
+    try:
+        await redis_conn.incr(portfolio_version_key(user_id))
+    except RedisError as e:
+        logging.error(f"Could not bump portfolio version of user {user_id}: {e}")
+        try:
+            await redis_conn.delete(portfolio_version_key(user_id))
+        except RedisError as e:
+            logging.error(f"Could not drop portfolio version of user {user_id}: {e}")
+
+
+async def get_portfolio_etag(user_id, redis_conn, fingerprint: str):
+    """
+    Weak ETag of the portfolio response, from the user's portfolio version, the
+    version of the prices published by the price updater and the fingerprint of
+    the holdings read from the database. The Redis counters are bumped on a best
+    effort basis and restart at 0 when Redis loses its data; the fingerprint
+    keeps such a tag from matching one issued for different contents.
+    """
+    portfolio_version, prices_version = await redis_conn.mget(
+        portfolio_version_key(user_id), config.PRICES_VERSION_KEY
+    )
+    return f'W/"p{portfolio_version or 0}-{prices_version or 0}-{fingerprint}"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def not_modified(etag: str) -> Response:
+    _stats["not_modified"] += 1
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+
+def remember_portfolio(user_id, etag, coin_ids):
+    _remember(_served_portfolios, user_id, (etag, coin_ids), config.SERVED_PORTFOLIOS_CACHE_SIZE)
+
+
+def served_portfolio_ids(user_id, etag):
+    entry = _served_portfolios.get(user_id)
+    if entry is None or entry[0] != etag:
+        return None
+    return entry[1]
+
+
+def _compress(body: bytes) -> dict:
+    if len(body) < config.RESPONSE_COMPRESS_MIN_BYTES:
+        return {}
+    encoded = {"gzip": gzip.compress(body, compresslevel=6)}
+    if brotli is not None:
+        encoded["br"] = brotli.compress(body)
+    return encoded
+
+
+def get_search_body(generation, symbol):
+    entry = _search_bodies.get((generation, symbol))
+    if entry is None:
+        _stats["search_misses"] += 1
+        return None
+    _stats["search_hits"] += 1
+    _search_bodies.move_to_end((generation, symbol))
+    return entry
+
+
+def store_search_body(generation, symbol, coins):
+    """
+    Serialize (and compress, when large) a search result once per catalogue generation.
+    """
+    body = json.dumps(sorted(coins, key=lambda coin: coin["id_text"])).encode()
+    entry = (body, _compress(body))
+    _remember(_search_bodies, (generation, symbol), entry, config.SEARCH_RESPONSE_CACHE_SIZE)
+    return entry
+
+
+def encoded_response(request: Request, entry, etag: str) -> Response:
+    """
+    JSON response of a cached body, in the best encoding the client accepts.
+    """
+    body, encoded = entry
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    accepted = {value.split(";")[0].strip() for value in request.headers.get("accept-encoding", "").split(",")}
+    for encoding in ("br", "gzip"):
+        if encoding in encoded and encoding in accepted:
+            headers["Content-Encoding"] = encoding
+            return Response(encoded[encoding], media_type="application/json", headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
@@ -0,0 +1,223 @@
+import os
+from contextvars import ContextVar
+from time import perf_counter
+
+import redis.asyncio as redis
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+from redis.asyncio.client import Pipeline
+from sqlalchemy import event
+
+# Buckets in seconds, from a Redis round trip to a slow upstream call
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests by route template.",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Duration of SQL statements by statement type.",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_QUERY_ERRORS = Counter("db_query_errors_total", "SQL statements that raised.", ["operation"])
+REDIS_COMMAND_DURATION = Histogram(
+    "redis_command_duration_seconds",
+    "Duration of Redis commands; a pipeline is observed once as PIPELINE.",
+    ["command"],
+    buckets=LATENCY_BUCKETS,
+)
+REDIS_COMMAND_ERRORS = Counter("redis_command_errors_total", "Redis commands that raised.", ["command"])
+COINGECKO_REQUEST_DURATION = Histogram(
+    "coingecko_request_duration_seconds",
+    "Latency of CoinGecko requests by endpoint and status code.",
+    ["endpoint", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Statements are cut to this length in profile reports
+PROFILE_STATEMENT_MAX_CHARS = 500
+
+# Profile of the request being handled, set by ProfilingMiddleware
+current_profile: ContextVar["RequestProfile | None"] = ContextVar("request_profile", default=None)
+
+
+class RequestProfile:
+    """
+    Time one request spent in each span (db, redis, coingecko, password_hash),
+    collected by the hooks below for app.lib.profiling. Tasks started by the
+    request copy its context and record into the same profile.
+    """
+
+    __slots__ = ("spans", "queries")
+
+    def __init__(self):
+        # span -> [seconds, calls]
+        self.spans = {}
+        # SQL statement -> [seconds, executions]
+        self.queries = {}
+
+    def add(self, span, seconds, statement=None):
+        entry = self.spans.get(span)
+        if entry is None:
+            self.spans[span] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+        if statement is not None:
+            entry = self.queries.get(statement)
+            if entry is None:
+                self.queries[statement] = [seconds, 1]
+            else:
+                entry[0] += seconds
+                entry[1] += 1
+
+    def breakdown(self, duration):
+        """
+        Milliseconds and calls per span. "other" is the rest of the wall time:
+        Python code of the request plus waiting for the event loop. Spans of
+        concurrent calls overlap, so they can add up to more than the wall time.
+        """
+        spans = {name: {"ms": round(seconds * 1000, 2), "calls": calls} for name, (seconds, calls) in self.spans.items()}
+        covered = sum(seconds for seconds, _ in self.spans.values())
+        spans["other"] = {"ms": round(max(duration - covered, 0) * 1000, 2)}
+        return spans
+
+    def top_queries(self, limit):
+        ranked = sorted(self.queries.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        return [
+            {"statement": statement[:PROFILE_STATEMENT_MAX_CHARS], "ms": round(seconds * 1000, 2), "count": count}
+            for statement, (seconds, count) in ranked
+        ]
+
+
+def record_span(span, seconds, statement=None):
+    """
+    Add a timing to the profile of the current request. A context variable
+    lookup when no request is being profiled.
+    """
+    profile = current_profile.get()
+    if profile is not None:
+        profile.add(span, seconds, statement)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware observing REQUEST_DURATION. Requests are labelled with
+    the route template (/portfolio/coin/{coin_text_id}/history), not the raw
+    path, so the number of series stays bounded. Server-sent event streams are
+    left out: their duration is how long the client stayed connected.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        streaming = False
+        started = perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                streaming = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", [])
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not streaming:
+                route = scope.get("route")
+                REQUEST_DURATION.labels(
+                    scope["method"], route.path if route is not None else "unmatched", str(status)
+                ).observe(perf_counter() - started)
+
+
+def _operation(statement: str) -> str:
+    words = statement.split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+
+def instrument_engine(engine):
+    """
+    Time every statement of an engine. Takes the sync engine behind an AsyncEngine.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - conn.info["query_started"].pop()
+        DB_QUERY_DURATION.labels(_operation(statement)).observe(elapsed)
+        record_span("db", elapsed, statement)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        stack = context.connection.info.get("query_started") if context.connection is not None else None
+        if stack:
+            stack.pop()
+        DB_QUERY_ERRORS.labels(_operation(context.statement or "")).inc()
+
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        started = perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        except Exception:
+            REDIS_COMMAND_ERRORS.labels("PIPELINE").inc()
+            raise
+        finally:
+            elapsed = perf_counter() - started
+            REDIS_COMMAND_DURATION.labels("PIPELINE").observe(elapsed)
+            record_span("redis", elapsed)
+
+
+class InstrumentedRedis(redis.Redis):
+    """
+    Redis client observing REDIS_COMMAND_DURATION for every command, including
+    the EVALSHA calls of registered scripts.
+    """
+
+    async def execute_command(self, *args, **options):
+        command = str(args[0]).upper()
+        started = perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        except Exception:
+            REDIS_COMMAND_ERRORS.labels(command).inc()
+            raise
+        finally:
+            elapsed = perf_counter() - started
+            REDIS_COMMAND_DURATION.labels(command).observe(elapsed)
+            record_span("redis", elapsed)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+def render_metrics():
+    """
+    Exposition of all metrics. With several uvicorn workers, set
+    PROMETHEUS_MULTIPROC_DIR so the series of every worker are merged.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+
+import app.config as config
+from app.lib.coin import get_coin_price
+
+
+class PriceBatcher:
+    """
+    Merges price lookups that arrive within a short window into a single
+    CoinGecko simple/price call and fans the result out to every caller.
+    A batch is sent when the window elapses or when it reaches max_ids.
+    """
+
+    def __init__(self, window_ms: int, max_ids: int):
+        self.window_ms = window_ms
+        self.max_ids = max_ids
+        # currency -> {coin_id: future resolved with the price}
+        self._pending = {}
+        self._timers = {}
+        self._tasks = set()
+        self._stats = {"requests": 0, "deduplicated": 0, "batches": 0, "ids_fetched": 0, "largest_batch": 0}
+
+    def get_stats(self):
+        batches = self._stats["batches"]
+        return {
+            **self._stats,
+            "window_ms": self.window_ms,
+            "max_ids": self.max_ids,
+            "average_batch": round(self._stats["ids_fetched"] / batches, 2) if batches else 0,
+            "upstream_calls_saved": self._stats["requests"] - batches,
+        }
+
+    async def get_price(self, coin_id: str, currency: str = "usd"):
+        """
+        Returns the price of coin_id, or None when CoinGecko did not return one.
+        """
+        self._stats["requests"] += 1
+        loop = asyncio.get_running_loop()
+        pending = self._pending.setdefault(currency, {})
+
+        future = pending.get(coin_id)
+        if future is not None:
+            self._stats["deduplicated"] += 1
+        else:
+            future = loop.create_future()
+            pending[coin_id] = future
+            if len(pending) >= self.max_ids:
+                self._flush(currency)
+            elif currency not in self._timers:
+                self._timers[currency] = loop.call_later(self.window_ms / 1000, self._flush, currency)
+
+        return await asyncio.shield(future)
+
+    def _flush(self, currency):
+        timer = self._timers.pop(currency, None)
+        if timer is not None:
+            timer.cancel()
+
+        batch = self._pending.pop(currency, None)
+        if batch:
+            task = asyncio.create_task(self._fetch(batch, currency))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, batch, currency):
+        self._stats["batches"] += 1
+        self._stats["ids_fetched"] += len(batch)
+        self._stats["largest_batch"] = max(self._stats["largest_batch"], len(batch))
+        logging.debug(f"Fetching {len(batch)} {currency} prices in one call")
+
+        try:
+            coin_price = await get_coin_price(",".join(batch), currency)
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for coin_id, future in batch.items():
+            if not future.done():
+                future.set_result(coin_price.get(coin_id, {}).get(currency))
+
+
+price_batcher = PriceBatcher(config.PRICE_BATCH_WINDOW_MS, config.PRICE_BATCH_MAX_IDS)
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from time import monotonic
+
+import app.config as config
+from app.lib.price_batcher import price_batcher
+from app.lib.redis import release_lock
+
+# (coin_id, currency) -> (expires_at, price), most recently used last
+_local_prices = OrderedDict()
+# (coin_id, currency) -> task loading the price, shared by concurrent callers
+_inflight = {}
+
+_stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "coalesced": 0}
+
+# Poll interval while another worker holds the upstream fetch of a key
+LOCK_POLL_SECONDS = 0.05
+
+
+def price_key(coin_id, currency):
+    return f"price:{currency}:{coin_id}"
+
+
+def price_lock_key(coin_id, currency):
+    return f"price_lock:{currency}:{coin_id}"
+
+
+def get_stats():
+    return {**_stats, "hits": _stats["local_hits"] + _stats["redis_hits"], "local_size": len(_local_prices)}
+
+
+def _get_local(key):
+    entry = _local_prices.get(key)
+    if entry is None:
+        return None
+    expires_at, price = entry
+    if expires_at <= monotonic():
+        del _local_prices[key]
+        return None
+    _local_prices.move_to_end(key)
+    return price
+
+
+def _set_local(key, price, ttl_seconds):
+    _local_prices[key] = (monotonic() + ttl_seconds, price)
+    _local_prices.move_to_end(key)
+    while len(_local_prices) > config.PRICE_CACHE_LOCAL_SIZE:
+        _local_prices.popitem(last=False)
+
+
+async def _get_shared(coin_id, currency, redis_conn):
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.get(price_key(coin_id, currency))
+    pipe.pttl(price_key(coin_id, currency))
+    price, ttl_ms = await pipe.execute()
+    if price is None:
+        return None
+    # Keep the local copy no longer than the shared one
+    ttl_seconds = ttl_ms / 1000 if ttl_ms > 0 else config.PRICE_CACHE_TTL_SECONDS
+    _set_local((coin_id, currency), float(price), ttl_seconds)
+    return float(price)
+
+
+async def _fetch_upstream(coin_id, currency, redis_conn, lock_token=None):
+    """
+    Fetch a price and publish it. With lock_token, the single-flight lock taken
+    with it is released in the same round trip, also when the fetch failed.
+    """
+    _stats["misses"] += 1
+    price = None
+    try:
+        price = await price_batcher.get_price(coin_id, currency)
+        return price
+    finally:
+        pipe = redis_conn.pipeline(transaction=False)
+        if price is not None:
+            pipe.set(price_key(coin_id, currency), price, ex=config.PRICE_CACHE_TTL_SECONDS)
+            _set_local((coin_id, currency), float(price), config.PRICE_CACHE_TTL_SECONDS)
+        if lock_token is not None:
+            await release_lock(pipe, price_lock_key(coin_id, currency), lock_token)
+        if len(pipe):
+            await pipe.execute()
+
+
+async def _load_price(coin_id, currency, redis_conn):
+    price = await _get_shared(coin_id, currency, redis_conn)
+    if price is not None:
+        _stats["redis_hits"] += 1
+        return price
+
+    # Only one worker fetches a key from CoinGecko, the others wait for its result
+    lock_token = uuid.uuid4().hex
+    lock_acquired = await redis_conn.set(
+        price_lock_key(coin_id, currency), lock_token, nx=True, px=config.PRICE_CACHE_LOCK_MS
+    )
+    if lock_acquired:
+        return await _fetch_upstream(coin_id, currency, redis_conn, lock_token)
+
+    _stats["coalesced"] += 1
+    deadline = monotonic() + config.PRICE_CACHE_LOCK_MS / 1000
+    while monotonic() < deadline:
+        await asyncio.sleep(LOCK_POLL_SECONDS)
+        price = await _get_shared(coin_id, currency, redis_conn)
+        if price is not None:
+            return price
+        if not await redis_conn.exists(price_lock_key(coin_id, currency)):
+            break
+
+    logging.warning(f"Price of {coin_id} was not published by another worker, fetching it directly")
+    return await _fetch_upstream(coin_id, currency, redis_conn)
+
+
+async def get_cached_price(coin_id, redis_conn, currency="usd"):
+    """
+    Read-through price lookup: in-process LRU, then Redis, then a batched CoinGecko call.
+    Concurrent misses of the same key are coalesced within the process and
+    across workers. Returns None when CoinGecko did not return a price.
+    """
+    key = (coin_id, currency)
+
+    price = _get_local(key)
+    if price is not None:
+        _stats["local_hits"] += 1
+        return price
+
+    task = _inflight.get(key)
+    if task is not None:
+        _stats["coalesced"] += 1
+    else:
+        task = asyncio.create_task(_load_price(coin_id, currency, redis_conn))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+
+    # Shield the shared task, so one cancelled caller does not cancel it for everybody
+    return await asyncio.shield(task)
+
+
+async def get_cached_prices(coin_ids, redis_conn, currency="usd") -> dict:
+    """
+    Prices of many coins at once, for batch operations: in-process LRU, then one
+    MGET, then the batcher for the remaining misses, which are written back with
+    one pipeline. Returns {coin_id: price} without the coins CoinGecko has no price for.
+    """
+    prices = {}
+    misses = []
+    for coin_id in coin_ids:
+        price = _get_local((coin_id, currency))
+        if price is None:
+            misses.append(coin_id)
+        else:
+            prices[coin_id] = price
+    _stats["local_hits"] += len(prices)
+    if not misses:
+        return prices
+
+    # MGET does not return TTLs, so these are not copied into the local cache
+    upstream = []
+    for coin_id, price in zip(misses, await redis_conn.mget([price_key(coin_id, currency) for coin_id in misses])):
+        if price is None:
+            upstream.append(coin_id)
+        else:
+            prices[coin_id] = float(price)
+    _stats["redis_hits"] += len(misses) - len(upstream)
+    if not upstream:
+        return prices
+
+    _stats["misses"] += len(upstream)
+    fetched = await asyncio.gather(*(price_batcher.get_price(coin_id, currency) for coin_id in upstream))
+    pipe = redis_conn.pipeline(transaction=False)
+    for coin_id, price in zip(upstream, fetched):
+        if price is not None:
+            prices[coin_id] = price
+            pipe.set(price_key(coin_id, currency), price, ex=config.PRICE_CACHE_TTL_SECONDS)
+            _set_local((coin_id, currency), float(price), config.PRICE_CACHE_TTL_SECONDS)
+    if len(pipe):
+        await pipe.execute()
+    return prices
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+
+import app.config as config
+
+# Pause before resubscribing after the pub/sub connection failed
+RECONNECT_SECONDS = 1
+
+
+class PriceSubscription:
+    """
+    Prices of one connected client. Updates that arrive while the client is
+    still sending are merged, so a slow client only ever holds the latest
+    price of each of its coins.
+    """
+
+    def __init__(self, coin_ids):
+        self.coin_ids = frozenset(coin_ids)
+        self._pending = {}
+        self._ready = asyncio.Event()
+
+    def push(self, coin_id, price):
+        self._pending[coin_id] = price
+        self._ready.set()
+
+    async def next_prices(self, timeout: float) -> dict:
+        """
+        Prices changed since the previous call, or {} when nothing changed within timeout.
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self._ready.clear()
+        prices, self._pending = self._pending, {}
+        return prices
+
+
+class PriceStream:
+    """
+    Holds the single pub/sub subscription of this process to the price channel
+    and fans every message out to the clients holding the changed coins.
+    """
+
+    def __init__(self):
+        # coin_id -> subscriptions interested in it
+        self._subscribers = defaultdict(set)
+        self._subscriptions = 0
+        self._stats = {"messages": 0, "deliveries": 0, "reconnects": 0}
+
+    def get_stats(self):
+        return {**self._stats, "subscriptions": self._subscriptions, "coins": len(self._subscribers)}
+
+    def subscribe(self, coin_ids) -> PriceSubscription:
+        subscription = PriceSubscription(coin_ids)
+        for coin_id in subscription.coin_ids:
+            self._subscribers[coin_id].add(subscription)
+        self._subscriptions += 1
+        return subscription
+
+    def unsubscribe(self, subscription: PriceSubscription):
+        for coin_id in subscription.coin_ids:
+            subscribers = self._subscribers.get(coin_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[coin_id]
+        self._subscriptions -= 1
+
+    def dispatch(self, prices: dict):
+        self._stats["messages"] += 1
+        for coin_id, price in prices.items():
+            for subscription in self._subscribers.get(coin_id, ()):
+                subscription.push(coin_id, price)
+                self._stats["deliveries"] += 1
+
+    async def run(self, redis_conn):
+        """
+        Listen on PRICE_CHANNEL until cancelled, resubscribing after connection errors.
+        """
+        while True:
+            pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(config.PRICE_CHANNEL)
+                async for message in pubsub.listen():
+                    try:
+                        self.dispatch(json.loads(message["data"])["prices"])
+                    except (ValueError, KeyError, TypeError) as e:
+                        logging.warning(f"Ignoring malformed price message: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Price subscription failed: {e}")
+            finally:
+                await pubsub.aclose()
+
+            self._stats["reconnects"] += 1
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+
+price_stream = PriceStream()
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import logging
+import random
+import secrets
+import sys
+import threading
+import traceback
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from time import monotonic, perf_counter
+
+import app.config as config
+from app.lib.metrics import RequestProfile, current_profile
+from redis.exceptions import RedisError
+
+RECENT_PROFILES_KEY = "profiles:recent"
+# Statements are cut to this length in the slow-request log
+LOG_STATEMENT_MAX_CHARS = 200
+# Frames kept of the stack captured while the event loop is blocked
+LOOP_BLOCK_STACK_FRAMES = 20
+
+_stats = {"profiled": 0, "stored": 0, "slow": 0, "loop_blocks": 0}
+
+
+def profile_key(profile_id):
+    return f"profile:{profile_id}"
+
+
+def get_stats():
+    return dict(_stats)
+
+
+class LoopWatchdog:
+    """
+    Detects callbacks holding the event loop for LOOP_BLOCK_THRESHOLD_MS or more.
+    A heartbeat task stamps the time on every wake-up; a thread notices when the
+    stamp gets too old and captures the loop thread's stack while it is still
+    blocked. The heartbeat logs the block with that stack once the loop is free.
+    """
+
+    def __init__(self):
+        # (monotonic end, event) of recent blocks, the end lets reports pick their own
+        self._events = deque(maxlen=50)
+        self._beat = monotonic()
+        self._captured = None
+        self._stop = threading.Event()
+        self._task = None
+        self._interval = 0.0
+
+    def get_events(self):
+        return [event for _, event in self._events]
+
+    def events_between(self, started, ended):
+        events = [event for end, event in self._events if started <= end <= ended]
+        # A request that blocked the loop itself finishes before the heartbeat reports it.
+        # The last beat before the block can be up to one sleep older than the request.
+        captured = self._captured
+        if captured is not None and captured[0] >= started - 2 * self._interval:
+            blocked = ended - captured[0] - self._interval
+            events.append({"at": None, "blocked_ms": round(blocked * 1000, 1), "stack": captured[1]})
+        return events
+
+    def start(self):
+        threshold = config.LOOP_BLOCK_THRESHOLD_MS / 1000
+        if threshold <= 0 or self._task is not None:
+            return
+        interval = self._interval = threshold / 2
+        self._beat = monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat(interval, threshold))
+        threading.Thread(
+            target=self._watch,
+            args=(threading.get_ident(), interval, threshold),
+            name="loop-watchdog",
+            daemon=True,
+        ).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self, interval, threshold):
+        while True:
+            beat = self._beat = monotonic()
+            await asyncio.sleep(interval)
+            # How late the sleep returned, a lower bound of how long the loop was held
+            blocked = monotonic() - beat - interval
+            if blocked >= threshold:
+                captured, self._captured = self._captured, None
+                stack = captured[1] if captured is not None and captured[0] == beat else None
+                self._report(blocked, stack)
+
+    def _watch(self, loop_thread_id, interval, threshold):
+        while not self._stop.wait(interval / 2):
+            beat = self._beat
+            if monotonic() - beat < interval + threshold:
+                continue
+            if self._captured is None or self._captured[0] != beat:
+                frame = sys._current_frames().get(loop_thread_id)
+                if frame is not None:
+                    self._captured = (beat, "".join(traceback.format_stack(frame, limit=LOOP_BLOCK_STACK_FRAMES)))
+
+    def _report(self, blocked, stack):
+        _stats["loop_blocks"] += 1
+        event = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "blocked_ms": round(blocked * 1000, 1),
+            "stack": stack,
+        }
+        self._events.append((monotonic(), event))
+        message = f"Event loop blocked for at least {event['blocked_ms']:.0f} ms"
+        if stack:
+            message += f", stack while blocked:\n{stack}"
+        logging.warning(message)
+
+
+loop_watchdog = LoopWatchdog()
+
+
+def _format_slow(report):
+    spans = ", ".join(
+        f"{name} {span['ms']} ms" + (f"/{span['calls']}" if "calls" in span else "")
+        for name, span in report["spans"].items()
+    )
+    queries = "; ".join(
+        f"{query['ms']} ms x{query['count']}: {query['statement'][:LOG_STATEMENT_MAX_CHARS]}"
+        for query in report["top_queries"]
+    )
+    return (
+        f"Slow request {report['method']} {report['path']} ({report['status']}) took {report['duration_ms']} ms; "
+        f"spans: {spans}; top queries: {queries or 'none'}"
+    )
+
+
+async def _store_report(report):
+    redis_conn = config.get_redis_connection()
+    try:
+        async with redis_conn.pipeline(transaction=False) as pipe:
+            pipe.set(profile_key(report["id"]), json.dumps(report), ex=config.PROFILE_REPORT_TTL_SECONDS)
+            pipe.lpush(RECENT_PROFILES_KEY, report["id"])
+            pipe.ltrim(RECENT_PROFILES_KEY, 0, config.PROFILE_RECENT_REPORTS - 1)
+            await pipe.execute()
+        _stats["stored"] += 1
+    except RedisError as e:
+        logging.error(f"Could not store profile {report['id']}: {e}")
+
+
+async def get_report(profile_id, redis_conn):
+    report = await redis_conn.get(profile_key(profile_id))
+    return json.loads(report) if report else None
+
+
+async def get_recent_reports(redis_conn):
+    """
+    Summaries of the most recent reports that have not expired yet, newest first.
+    """
+    profile_ids = await redis_conn.lrange(RECENT_PROFILES_KEY, 0, -1)
+    if not profile_ids:
+        return []
+    reports = await redis_conn.mget([profile_key(profile_id) for profile_id in profile_ids])
+    summary_keys = ("id", "method", "path", "status", "started_at", "duration_ms")
+    return [{key: report[key] for key in summary_keys} for report in map(json.loads, filter(None, reports))]
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware. Every request collects its span timings, so one slower
+    than SLOW_REQUEST_MS can be logged with its top queries. Requests carrying
+    PROFILE_HEADER set to the API key, or sampled at PROFILE_SAMPLE_RATE, also
+    have their report stored in Redis; its id is returned as X-Profile-Id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.header = config.PROFILE_HEADER.lower().encode()
+        self.api_key = config.API_KEY.encode()
+
+    def _requested(self, scope):
+        for name, value in scope["headers"]:
+            if name == self.header:
+                return secrets.compare_digest(value, self.api_key)
+        return config.PROFILE_SAMPLE_RATE > 0 and random.random() < config.PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        profile_id = uuid.uuid4().hex if self._requested(scope) else None
+        if profile_id is None and not config.SLOW_REQUEST_MS:
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile()
+        response = {"status": 500, "streaming": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                headers = message.get("headers", [])
+                response["streaming"] = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream") for name, value in headers
+                )
+                if profile_id is not None:
+                    message = {**message, "headers": [*headers, (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        started_at = datetime.now(timezone.utc)
+        started = perf_counter()
+        started_monotonic = monotonic()
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = perf_counter() - started
+            current_profile.reset(token)
+            slow = config.SLOW_REQUEST_MS and duration * 1000 >= config.SLOW_REQUEST_MS and not response["streaming"]
+            if profile_id is not None or slow:
+                route = scope.get("route")
+                report = {
+                    "id": profile_id,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": route.path if route is not None else None,
+                    "status": response["status"],
+                    "started_at": started_at.isoformat(),
+                    "duration_ms": round(duration * 1000, 2),
+                    "spans": profile.breakdown(duration),
+                    "top_queries": profile.top_queries(config.PROFILE_TOP_QUERIES),
+                    "loop_blocks": loop_watchdog.events_between(started_monotonic, monotonic()),
+                }
+                if slow:
+                    _stats["slow"] += 1
+                    logging.warning(_format_slow(report))
+
+        if profile_id is not None:
+            _stats["profiled"] += 1
+            # The response is complete by now, storing does not delay the client
+            await _store_report(report)
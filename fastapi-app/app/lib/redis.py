@@ -1,52 +1,304 @@
+import asyncio
+import json
 import logging
+import uuid
+from collections import defaultdict
+from time import perf_counter, time
 
 import app.config as config
 from app.lib.coin import download_coins_list_data
-from app.models.coin import CoinCreate
+from redis.commands.core import AsyncScript
 
+# Keep references to background purge tasks so they are not garbage collected
+_background_tasks = set()
 
-async def store_coin_by_id(coin_id, coin_data, redis_conn):
-    redis_conn.hmset(f"coin:{coin_id}", coin_data)
+# The lookup scripts build the coin:, symbol: and symbol_blob: key names from the
+# generation they read, instead of receiving them in KEYS, to save a round trip.
+# That assumes a single Redis node (replicas are fine); it does not work on Redis
+# Cluster, where a script may only touch keys passed in KEYS, all in one slot.
 
+# Resolve the current generation and fetch a coin hash in one round trip
+GET_COIN_BY_ID_SCRIPT = """
+local generation = redis.call('GET', KEYS[1])
+if not generation then
+    return {}
+end
+return redis.call('HGETALL', 'coin:' .. generation .. ':' .. ARGV[1])
+"""
 
-async def store_coin_by_symbol(symbol, coin_id, redis_conn):
-    redis_conn.sadd(f"symbol:{symbol}", coin_id)
+# Resolve the current generation and fetch every coin sharing a symbol in one round trip.
+# Returns {1, blob} when a precomputed result exists, otherwise {0, hash, hash, ...}.
+GET_COINS_BY_SYMBOL_SCRIPT = """
+local generation = redis.call('GET', KEYS[1])
+if not generation then
+    return {0}
+end
+local blob = redis.call('GET', 'symbol_blob:' .. generation .. ':' .. ARGV[1])
+if blob then
+    return {1, blob}
+end
+local result = {0}
+for _, coin_id in ipairs(redis.call('SMEMBERS', 'symbol:' .. generation .. ':' .. ARGV[1])) do
+    result[#result + 1] = redis.call('HGETALL', 'coin:' .. generation .. ':' .. coin_id)
+end
+return result
+"""
+
+# Delete a lock only while it still holds our token, never one that expired and was taken by another worker
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Built once per process from the encoded source, so no client is needed to hash it.
+# Every call passes the client to run on; the first EVALSHA a server has not seen
+# falls back to SCRIPT LOAD.
+_get_coin_by_id = AsyncScript(None, GET_COIN_BY_ID_SCRIPT.encode())
+_get_coins_by_symbol = AsyncScript(None, GET_COINS_BY_SYMBOL_SCRIPT.encode())
+_release_lock = AsyncScript(None, RELEASE_LOCK_SCRIPT.encode())
+
+
+def coin_key(generation, coin_id):
+    return f"coin:{generation}:{coin_id}"
+
+
+def symbol_key(generation, symbol):
+    return f"symbol:{generation}:{symbol}"
+
+
+def symbol_blob_key(generation, symbol):
+    return f"symbol_blob:{generation}:{symbol}"
+
+
+def catalogue_blob_key(generation):
+    return f"catalogue_blob:{generation}"
+
+
+def _hash_from_pairs(pairs):
+    return dict(zip(pairs[::2], pairs[1::2]))
+
+
+async def get_catalogue_generation(redis_conn):
+    return await redis_conn.get(config.CATALOGUE_CURRENT_KEY)
 
 
 async def get_coin_by_id(coin_id, redis_conn):
-    coin = redis_conn.hgetall(f"coin:{coin_id}")
-    return coin
+    coin = await _get_coin_by_id(keys=[config.CATALOGUE_CURRENT_KEY], args=[coin_id], client=redis_conn)
+    return _hash_from_pairs(coin)
 
 
-async def get_coins_by_symbol(symbol, redis_conn):
-    coin_ids = redis_conn.smembers(f"symbol:{symbol}")
-    coins = []
+async def get_coins_by_ids(coin_ids, redis_conn):
+    """
+    Catalogue entries of many coins, fetched with one pipeline.
+    Returns {coin_id: coin hash} for the ids present in the current generation.
+    """
+    generation = await get_catalogue_generation(redis_conn)
+    if generation is None or not coin_ids:
+        return {}
+
+    pipe = redis_conn.pipeline(transaction=False)
     for coin_id in coin_ids:
-        coin = redis_conn.hgetall(f"coin:{coin_id}")
-        coins.append(coin)
-    return coins
+        pipe.hgetall(coin_key(generation, coin_id))
+    coins = await pipe.execute()
+    return {coin_id: coin for coin_id, coin in zip(coin_ids, coins) if coin}
+
+
+async def get_coins_by_symbol(symbol, redis_conn):
+    result = await _get_coins_by_symbol(keys=[config.CATALOGUE_CURRENT_KEY], args=[symbol], client=redis_conn)
+    if result[0] == 1:
+        return json.loads(result[1])
+    return [_hash_from_pairs(coin) for coin in result[1:]]
+
+
+async def record_coin_reads(coin_ids, redis_conn):
+    """
+    Remember when coins were last shown to a user, so the price updater
+    can refresh the coins people actually look at more often.
+    """
+    if coin_ids:
+        await redis_conn.zadd(config.COIN_READS_KEY, dict.fromkeys(coin_ids, time()))
+
+
+async def bulk_load_coins(coins, redis_conn, generation, chunk_size=None):
+    """
+    Stream (id, symbol, name) tuples into Redis using non-transactional pipelines.
+    Every chunk is sent in a single round trip. Returns the number of keys written.
+    """
+    chunk_size = chunk_size or config.REDIS_BULK_CHUNK_SIZE
+    symbols = set()
+    started = perf_counter()
+
+    for start in range(0, len(coins), chunk_size):
+        chunk = coins[start : start + chunk_size]
+        chunk_started = perf_counter()
+
+        pipe = redis_conn.pipeline(transaction=False)
+        for id, symbol, name in chunk:
+            pipe.hset(coin_key(generation, id), mapping={"id_text": id, "name": name, "symbol": symbol})
+            pipe.sadd(symbol_key(generation, symbol), id)
+            symbols.add(symbol)
+        await pipe.execute()
+
+        logging.info(
+            f"Loaded chunk {start // chunk_size + 1} ({len(chunk)} coins) "
+            f"in {(perf_counter() - chunk_started) * 1000:.1f} ms"
+        )
+
+    keys_written = len(coins) + len(symbols)
+    if config.REDIS_SYMBOL_BLOBS:
+        keys_written += await store_symbol_blobs(coins, redis_conn, generation, chunk_size)
+    keys_written += await store_catalogue_blob(coins, redis_conn, generation)
+    logging.info(f"Bulk load wrote {keys_written} keys in {(perf_counter() - started) * 1000:.1f} ms")
+    return keys_written
+
+
+async def store_symbol_blobs(coins, redis_conn, generation, chunk_size=None):
+    """
+    Precompute the search result of every symbol as a JSON blob.
+    Returns the number of keys written.
+    """
+    chunk_size = chunk_size or config.REDIS_BULK_CHUNK_SIZE
+    by_symbol = defaultdict(list)
+    for id, symbol, name in coins:
+        by_symbol[symbol].append({"id_text": id, "name": name, "symbol": symbol})
+
+    symbols = list(by_symbol)
+    for start in range(0, len(symbols), chunk_size):
+        pipe = redis_conn.pipeline(transaction=False)
+        for symbol in symbols[start : start + chunk_size]:
+            pipe.set(symbol_blob_key(generation, symbol), json.dumps(by_symbol[symbol]))
+        await pipe.execute()
+
+    return len(symbols)
+
+
+async def store_catalogue_blob(coins, redis_conn, generation):
+    """
+    Store the whole catalogue as one JSON blob, so every worker can build
+    its in-memory search index with a single GET.
+    """
+    await redis_conn.set(catalogue_blob_key(generation), json.dumps(coins))
+    return 1
+
+
+async def get_catalogue_blob(generation, redis_conn):
+    blob = await redis_conn.get(catalogue_blob_key(generation))
+    return json.loads(blob) if blob else []
+
+
+async def purge_catalogue_generation(generation, redis_conn, chunk_size=None):
+    """
+    Delete every key of a catalogue generation with SCAN + UNLINK,
+    so the memory is reclaimed without blocking Redis.
+    """
+    chunk_size = chunk_size or config.REDIS_BULK_CHUNK_SIZE
+    deleted = await redis_conn.unlink(catalogue_blob_key(generation))
+
+    patterns = (coin_key(generation, "*"), symbol_key(generation, "*"), symbol_blob_key(generation, "*"))
+    for pattern in patterns:
+        batch = []
+        async for key in redis_conn.scan_iter(match=pattern, count=chunk_size):
+            batch.append(key)
+            if len(batch) >= chunk_size:
+                deleted += await redis_conn.unlink(*batch)
+                batch = []
+        if batch:
+            deleted += await redis_conn.unlink(*batch)
+
+    logging.info(f"Purged {deleted} keys of catalogue generation {generation}")
+    return deleted
+
+
+async def _purge_later(generation, redis_conn):
+    await asyncio.sleep(config.CATALOGUE_PURGE_DELAY_SECONDS)
+    await purge_catalogue_generation(generation, redis_conn)
+
+
+async def publish_catalogue_generation(generation, redis_conn):
+    """
+    Make a fully loaded generation visible with a single pointer flip and
+    schedule the previous generation for deletion in the background.
+    """
+    previous = await redis_conn.set(config.CATALOGUE_CURRENT_KEY, generation, get=True)
+    logging.info(f"Published catalogue generation {generation} (previous: {previous})")
+
+    if previous is not None and str(previous) != str(generation):
+        task = asyncio.create_task(_purge_later(previous, redis_conn))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+
+async def refresh_catalogue(redis_conn):
+    coins = await download_coins_list_data()
+
+    if not coins:
+        logging.info("No coins found or there was an error.")
+        return None
+
+    logging.info(f"Get {len(coins)} coins.")
+
+    generation = await redis_conn.incr(config.CATALOGUE_SEQUENCE_KEY)
+    try:
+        await bulk_load_coins(coins, redis_conn, generation)
+    except Exception:
+        # Never publish a half-written generation
+        await purge_catalogue_generation(generation, redis_conn)
+        raise
+
+    await publish_catalogue_generation(generation, redis_conn)
+    return generation
 
 
 async def initialize_redis(redis_conn):
     # Try get key
-    lock_acquired = redis_conn.setnx(config.REDIS_LOCK_KEY, "locked")
+    lock_acquired = await redis_conn.setnx(config.REDIS_LOCK_KEY, "locked")
     if not lock_acquired:
         logging.debug("Lock already acquired by another server.")
         return
 
     # Expired after 10 minutes
-    redis_conn.expire(config.REDIS_LOCK_KEY, 600)
+    await redis_conn.expire(config.REDIS_LOCK_KEY, 600)
 
-    coins = await download_coins_list_data()
+    await refresh_catalogue(redis_conn)
 
-    if coins:
-        logging.info(f"Get {len(coins)} coins.")
 
-        for id, symbol, name in coins:
-            coin_data = CoinCreate(id_text=id, name=name, symbol=symbol, price=0)
+async def release_lock(redis_conn, key, token):
+    """
+    Delete a lock taken with SET NX and a random token, unless it expired and
+    another worker holds it now. On a pipeline the call is queued with it.
+    """
+    await _release_lock(keys=[key], args=[token], client=redis_conn)
 
-            await store_coin_by_id(id, coin_data.__dict__, redis_conn)
-            await store_coin_by_symbol(symbol, id, redis_conn)
 
-    else:
-        logging.info("No coins found or there was an error.")
+async def refresh_catalogue_locked(redis_conn):
+    """
+    Refresh the catalogue unless another worker is already doing it.
+    The lock carries a random token and is released as soon as the load is done.
+    """
+    token = uuid.uuid4().hex
+    lock_acquired = await redis_conn.set(
+        config.CATALOGUE_REFRESH_LOCK_KEY, token, nx=True, ex=config.CATALOGUE_REFRESH_LOCK_SECONDS
+    )
+    if not lock_acquired:
+        logging.debug("Catalogue refresh already running on another worker.")
+        return None
+
+    try:
+        return await refresh_catalogue(redis_conn)
+    finally:
+        await release_lock(redis_conn, config.CATALOGUE_REFRESH_LOCK_KEY, token)
+
+
+async def refresh_catalogue_periodically(redis_conn):
+    """
+    Background loop that refreshes the catalogue every CATALOGUE_REFRESH_SECONDS.
+    refresh_catalogue_locked keeps concurrent workers from loading it twice at once.
+    """
+    while True:
+        await asyncio.sleep(config.CATALOGUE_REFRESH_SECONDS)
+        try:
+            await refresh_catalogue_locked(redis_conn)
+        except Exception as e:
+            logging.error(f"Catalogue refresh failed: {e}")
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from bisect import bisect_left
+from collections import defaultdict
+from time import perf_counter
+
+import app.config as config
+import numpy as np
+from app.lib.redis import get_catalogue_blob, get_catalogue_generation
+
+# Ranking of match kinds, higher is better
+EXACT_SYMBOL = 4.0
+EXACT_NAME = 3.5
+SYMBOL_PREFIX = 3.0
+NAME_PREFIX = 2.0
+# Fuzzy matches score their trigram similarity (0..1) and need at least this much
+MIN_SIMILARITY = 0.3
+
+# Prefix matches inspected per query, in lexical order (shortest completions first)
+PREFIX_CANDIDATES = 200
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    Read-only typeahead index over the coin catalogue of one generation.
+    Sorted symbol and name arrays answer exact and prefix queries with bisect,
+    a trigram index answers typo-tolerant queries.
+    """
+
+    def __init__(self, coins, generation):
+        self.generation = generation
+        self.ids = [coin[0] for coin in coins]
+        self.symbols = [coin[1] for coin in coins]
+        self.names = [coin[2] for coin in coins]
+
+        symbol_keys = sorted((symbol.lower(), i) for i, symbol in enumerate(self.symbols))
+        self._symbol_keys = [key for key, _ in symbol_keys]
+        self._symbol_positions = [i for _, i in symbol_keys]
+
+        name_keys = sorted((name.lower(), i) for i, name in enumerate(self.names))
+        self._name_keys = [key for key, _ in name_keys]
+        self._name_positions = [i for _, i in name_keys]
+
+        postings = defaultdict(list)
+        trigram_counts = np.zeros(len(coins), dtype=np.int32)
+        for i, (symbol, name) in enumerate(zip(self.symbols, self.names)):
+            grams = _trigrams(symbol.lower()) | _trigrams(name.lower())
+            trigram_counts[i] = len(grams)
+            for gram in grams:
+                postings[gram].append(i)
+        self._postings = {gram: np.array(positions, dtype=np.int32) for gram, positions in postings.items()}
+        self._trigram_counts = trigram_counts
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _prefix_matches(self, keys, positions, query):
+        start = bisect_left(keys, query)
+        end = min(bisect_left(keys, query + "\uffff"), start + PREFIX_CANDIDATES)
+        return [(keys[i], positions[i]) for i in range(start, end)]
+
+    def _fuzzy_matches(self, query, limit):
+        grams = [self._postings[gram] for gram in _trigrams(query) if gram in self._postings]
+        if not grams:
+            return []
+
+        shared = np.bincount(np.concatenate(grams), minlength=len(self.ids))
+        similarity = shared / (len(_trigrams(query)) + self._trigram_counts - shared)
+        top = np.argpartition(-similarity, min(limit, len(similarity) - 1))[:limit]
+        return [(float(similarity[i]), int(i)) for i in top if similarity[i] >= MIN_SIMILARITY]
+
+    def search(self, query, limit=10):
+        """
+        Ranked top-`limit` coins for a typeahead query: exact symbol, exact name,
+        symbol prefix, name prefix, then fuzzy trigram matches.
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        scores = {}
+
+        def add(position, score):
+            if score > scores.get(position, 0):
+                scores[position] = score
+
+        for key, position in self._prefix_matches(self._symbol_keys, self._symbol_positions, query):
+            # Shorter completions rank higher within the same kind
+            add(position, EXACT_SYMBOL if key == query else SYMBOL_PREFIX - len(key) / 1000)
+        for key, position in self._prefix_matches(self._name_keys, self._name_positions, query):
+            add(position, EXACT_NAME if key == query else NAME_PREFIX - len(key) / 1000)
+
+        if len(scores) < limit and len(query) >= 3:
+            for similarity, position in self._fuzzy_matches(query, limit):
+                add(position, similarity)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.ids[item[0]]))[:limit]
+        return [
+            {"id_text": self.ids[position], "symbol": self.symbols[position], "name": self.names[position]}
+            for position, _ in ranked
+        ]
+
+
+_index = None
+
+
+def search_coins(query, limit=10):
+    """
+    Query this worker's index. Returns [] until the first index has been built.
+    """
+    if _index is None:
+        return []
+    return _index.search(query, limit)
+
+
+async def refresh_search_index(redis_conn):
+    """
+    Rebuild the index when the published catalogue generation changed.
+    The build runs in a thread so it does not stall the event loop.
+    """
+    global _index
+    generation = await get_catalogue_generation(redis_conn)
+    if generation is None or (_index is not None and _index.generation == generation):
+        return
+
+    coins = await get_catalogue_blob(generation, redis_conn)
+    if not coins:
+        return
+
+    started = perf_counter()
+    _index = await asyncio.to_thread(SearchIndex, coins, generation)
+    logging.info(
+        f"Built search index of {len(_index)} coins for generation {generation} "
+        f"in {(perf_counter() - started) * 1000:.1f} ms"
+    )
+
+
+async def refresh_search_index_periodically(redis_conn):
+    while True:
+        try:
+            await refresh_search_index(redis_conn)
+        except Exception as e:
+            logging.error(f"Search index refresh failed: {e}")
+        await asyncio.sleep(config.SEARCH_INDEX_CHECK_SECONDS)
@@ -1,20 +1,63 @@
+import asyncio
 import logging
 
 import app.config as config
-from app.lib.redis import initialize_redis
+from app.lib.auth import shutdown_password_pool, verify_api_key
+from app.lib.metrics import (MetricsMiddleware, instrument_engine,
+                             render_metrics)
+from app.lib.price_stream import price_stream
+from app.lib.profiling import ProfilingMiddleware, loop_watchdog
+from app.lib.redis import initialize_redis, refresh_catalogue_periodically
+from app.lib.search_index import refresh_search_index_periodically
 from app.routers.auth import router as auth_router
+from app.routers.internal import router as internal_router
 from app.routers.portfolio import router as user_crypto_router
-from fastapi import FastAPI
+from app.routers.stream import router as stream_router
+from fastapi import Depends, FastAPI, Response
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware)
+instrument_engine(config.engine.sync_engine)
 
 
 @app.on_event("startup")
 async def startup_event():
-    redis_conn = config.get_redis_connection()
+    loop_watchdog.start()
+    config.init_http_client()
+    redis_conn = config.init_redis_pool()
     logging.debug("Checking Redis initialization...")
     await initialize_redis(redis_conn)
 
+    app.state.search_index_task = asyncio.create_task(refresh_search_index_periodically(redis_conn))
+    app.state.price_stream_task = asyncio.create_task(price_stream.run(redis_conn))
+
+    if config.CATALOGUE_REFRESH_SECONDS > 0:
+        app.state.catalogue_refresh_task = asyncio.create_task(refresh_catalogue_periodically(redis_conn))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task_name in ("catalogue_refresh_task", "search_index_task", "price_stream_task"):
+        task = getattr(app.state, task_name, None)
+        if task:
+            task.cancel()
+
+    await config.close_redis_pool()
+    await config.close_http_client()
+    await config.close_db_engine()
+    shutdown_password_pool()
+    loop_watchdog.stop()
+
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(verify_api_key)])
+async def metrics():
+    # Behind the API key like /internal, Prometheus sends it as the X-API-KEY scrape header
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
 
 app.include_router(auth_router)
 app.include_router(user_crypto_router)
+app.include_router(stream_router)
+app.include_router(internal_router)
@@ -1,3 +1,6 @@
+from datetime import datetime
+from typing import List
+
 from pydantic import BaseModel
 
 
@@ -12,3 +15,17 @@ class CoinCreate(CoinBase):
 
     class Config:
         orm_mode = True
+
+
+class PricePoint(BaseModel):
+    bucket: datetime
+    open: float
+    high: float
+    low: float
+    close: float
+
+
+class PriceHistory(BaseModel):
+    id_text: str
+    resolution: int
+    points: List[PricePoint]
@@ -0,0 +1,50 @@
+from typing import List, Literal, Optional
+
+from app.config import PORTFOLIO_BATCH_MAX_OPERATIONS
+from pydantic import BaseModel, Field
+
+
+class HoldingAnalytics(BaseModel):
+    id_text: str
+    symbol: str
+    name: str
+    price: float
+    weight: Optional[float]
+    change_24h: Optional[float]
+    change_7d: Optional[float]
+    volatility: Optional[float]
+
+
+class CorrelationMatrix(BaseModel):
+    ids: List[str]
+    matrix: List[List[Optional[float]]]
+
+
+class PortfolioAnalytics(BaseModel):
+    total_value: float
+    holdings: List[HoldingAnalytics]
+    correlation: CorrelationMatrix
+
+
+class CoinOperation(BaseModel):
+    op: Literal["add", "remove", "replace"]
+    id_text: str
+    # Coin that replaces id_text, only used by "replace"
+    to_id_text: Optional[str] = None
+
+
+class CoinBatch(BaseModel):
+    operations: List[CoinOperation] = Field(..., min_length=1, max_length=PORTFOLIO_BATCH_MAX_OPERATIONS)
+
+
+class CoinOperationResult(BaseModel):
+    op: str
+    id_text: str
+    to_id_text: Optional[str] = None
+    status: int
+    detail: str
+
+
+class CoinBatchResult(BaseModel):
+    applied: int
+    results: List[CoinOperationResult]
@@ -10,36 +10,37 @@ from app.models.token import Token
 from app.models.user import UserCreate
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(tags=["Authorization"])
 
 
 @router.post("/register")
-def register(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: Session = Depends(get_db)):
+async def register(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: AsyncSession = Depends(get_db)):
     # Zkontrolujete, zda už uživatel existuje
     email = form_data.username
-    db_user = db.query(User).filter(User.email == email).first()
+    db_user = (await db.execute(select(User).where(User.email == email))).scalars().first()
 
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = get_password_hash(form_data.password)
+    hashed_password = await get_password_hash(form_data.password)
     new_user = UserCreate(email=email, password=hashed_password)
 
     db_user = User(**new_user.dict())  # Convert to SQLAlchemy model
 
     db.add(db_user)
-    db.commit()
+    await db.commit()
     return {"message": "User created successfully"}
 
 
 @router.post("/token")
 async def login_for_access_token(
-    form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: Session = Depends(get_db)
+    form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: AsyncSession = Depends(get_db)
 ) -> Token:
     email = form_data.username
-    user = authenticate_user(db, email, form_data.password)
+    user = await authenticate_user(db, email, form_data.password)
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
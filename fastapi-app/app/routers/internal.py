@@ -0,0 +1,40 @@
+import app.config as config
+from app.config import get_redis
+from app.lib import http_cache, price_cache, profiling
+from app.lib.auth import verify_api_key
+from app.lib.price_batcher import price_batcher
+from app.lib.price_stream import price_stream
+from fastapi import APIRouter, Depends, HTTPException
+from redis.asyncio import Redis
+
+router = APIRouter(prefix="/internal", tags=["Internal"], dependencies=[Depends(verify_api_key)])
+
+
+@router.get("/stats")
+async def internal_stats():
+    return {
+        "price_cache": price_cache.get_stats(),
+        "price_batcher": price_batcher.get_stats(),
+        "price_stream": price_stream.get_stats(),
+        "http_cache": http_cache.get_stats(),
+        "profiling": profiling.get_stats(),
+        "db_pool": config.get_db_pool_stats(),
+    }
+
+
+@router.get("/profiles")
+async def recent_profiles(redis_conn: Redis = Depends(get_redis)):
+    return await profiling.get_recent_reports(redis_conn)
+
+
+@router.get("/profiles/{profile_id}")
+async def profile_report(profile_id: str, redis_conn: Redis = Depends(get_redis)):
+    report = await profiling.get_report(profile_id, redis_conn)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found or expired")
+    return report
+
+
+@router.get("/loop-blocks")
+async def loop_blocks():
+    return profiling.loop_watchdog.get_events()
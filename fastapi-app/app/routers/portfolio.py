@@ -1,86 +1,136 @@
 import logging
+from datetime import datetime, timedelta, timezone
 from typing import Annotated, List
 
-import redis
-from app.config import get_db, get_redis
-from app.db.schema import Coin, User
+from app.config import (HISTORY_ANALYTICS_MAX_DAYS, HISTORY_MAX_POINTS, get_db,
+                        get_redis)
+from app.db.schema import Coin
+from app.lib.analytics import get_portfolio_analytics
 from app.lib.auth import get_current_active_user
-from app.lib.coin import get_coin_price
-from app.lib.redis import get_coin_by_id, get_coins_by_symbol
-from app.models.coin import CoinBase
+from app.lib.history import get_price_history, to_utc_naive
+from app.lib.holdings import (add_holding, apply_operations, coin_exists,
+                              get_holdings, holdings_fingerprint,
+                              remove_holding)
+from app.lib.http_cache import (bump_portfolio_version, encoded_response,
+                                get_portfolio_etag, get_search_body,
+                                is_not_modified, not_modified,
+                                remember_portfolio, served_portfolio_ids,
+                                store_search_body)
+from app.lib.price_cache import get_cached_price
+from app.lib.redis import (get_catalogue_generation, get_coin_by_id,
+                           get_coins_by_symbol, record_coin_reads)
+from app.lib.search_index import search_coins
+from app.models.coin import CoinBase, PriceHistory
+from app.models.portfolio import CoinBatch, CoinBatchResult, PortfolioAnalytics
 from app.models.user import UserResponse
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from redis.asyncio import Redis
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter(prefix="/portfolio", tags=["Portfolio"])
 
 
 @router.get("/coin/")
 async def portfolio_coin(
+    request: Request,
+    response: Response,
     current_user: Annotated[UserResponse, Depends(get_current_active_user)],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
+    redis_conn: Redis = Depends(get_redis),
 ):
     try:
-        user = db.query(User).filter(User.id == current_user.id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
+        # Taken before reading, so a concurrent change can only make the ETag older than the data
+        etag = await get_portfolio_etag(current_user.id, redis_conn, await holdings_fingerprint(db, current_user.id))
+        if is_not_modified(request, etag):
+            coin_ids = served_portfolio_ids(current_user.id, etag)
+            if coin_ids:
+                await record_coin_reads(coin_ids, redis_conn)
+            return not_modified(etag)
 
-        return user.coins
+        coins = await get_holdings(db, current_user.id)
+        coin_ids = [coin.id_text for coin in coins]
+
+        await record_coin_reads(coin_ids, redis_conn)
+        remember_portfolio(current_user.id, etag, coin_ids)
+
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "private, no-cache"
+        return coins
 
     except HTTPException as e:
-        db.rollback()
+        await db.rollback()
         logging.error(f"HTTP Exception: {str(e)}")
         raise e
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logging.error(f"Unexpected error occurred: {str(e)}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
 
 
 @router.get("/coin/search/", response_model=List[CoinBase])
 async def search_coin(
+    request: Request,
     current_user: Annotated[UserResponse, Depends(get_current_active_user)],
     coin_cymbol: str,
-    redis_conn: redis.StrictRedis = Depends(get_redis),
+    redis_conn: Redis = Depends(get_redis),
 ):
     logging.debug(f"UserId: <{current_user.id}> search <{coin_cymbol}>")
-    coins_for_symbol = await get_coins_by_symbol(coin_cymbol, redis_conn)
-    if coins_for_symbol:
-        return coins_for_symbol
-    else:
+    generation = await get_catalogue_generation(redis_conn)
+    if generation is None:
         raise HTTPException(status_code=404, detail="Coin not found")
 
+    # Results only change with the catalogue generation
+    etag = f'W/"g{generation}"'
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    entry = get_search_body(generation, coin_cymbol)
+    if entry is None:
+        coins_for_symbol = await get_coins_by_symbol(coin_cymbol, redis_conn)
+        if not coins_for_symbol:
+            raise HTTPException(status_code=404, detail="Coin not found")
+        entry = store_search_body(generation, coin_cymbol, coins_for_symbol)
+
+    return encoded_response(request, entry, etag)
+
+
+@router.get("/coin/suggest/", response_model=List[CoinBase])
+async def suggest_coin(
+    current_user: Annotated[UserResponse, Depends(get_current_active_user)],
+    q: str = Query(..., min_length=1, max_length=64),
+    limit: int = Query(10, gt=0, le=50),
+):
+    # Answered from the in-memory index of this worker, without touching Redis
+    return search_coins(q, limit)
+
 
 @router.post("/coin/add/")
 async def add_coin(
     current_user: Annotated[UserResponse, Depends(get_current_active_user)],
     coin_text_id: str,
-    db: Session = Depends(get_db),
-    redis_conn: redis.StrictRedis = Depends(get_redis),
+    db: AsyncSession = Depends(get_db),
+    redis_conn: Redis = Depends(get_redis),
     currency: str = "usd",
 ):
     try:
-        user = db.query(User).filter(User.id == current_user.id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        coin = db.query(Coin).filter(Coin.id_text == coin_text_id).first()
+        # Coins already stored are linked with a single INSERT, the rest is the failure path
+        if not await add_holding(db, current_user.id, coin_text_id):
+            if await coin_exists(db, coin_text_id):
+                raise HTTPException(status_code=409, detail="Coin already assigned to this user")
 
-        if not coin:
             coin_redis = await get_coin_by_id(coin_text_id, redis_conn)
 
             if not coin_redis:
                 raise HTTPException(status_code=404, detail="Coin data not found")
 
             # Get actual coin price
-            coin_price = await get_coin_price(coin_text_id)
+            price = await get_cached_price(coin_text_id, redis_conn, currency)
 
-            if coin_text_id not in coin_price or currency not in coin_price[coin_text_id]:
+            if price is None:
                 logging.warning("API did not return value")
-
-            price = coin_price.get(coin_text_id, {}).get(currency, 0.0)
+                price = 0.0
 
             # Create new coin to database
             new_coin = Coin(
@@ -90,26 +140,28 @@ async def add_coin(
                 price=price,
             )
             db.add(new_coin)
-            coin = new_coin
+            await db.flush()
+
+            # Add coin to user portfolio
+            await add_holding(db, current_user.id, coin_text_id)
 
-        # Add coin to user portfolio
-        user.coins.append(coin)
-        db.commit()
+        await db.commit()
+        await bump_portfolio_version(current_user.id, redis_conn)
 
         return {"message": "Coin added to user portfolio successfully"}
 
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         logging.error(f"IntegrityError: {str(e)}")
         raise HTTPException(status_code=409, detail="Coin already assigned to this user")
 
     except HTTPException as e:
-        db.rollback()
+        await db.rollback()
         logging.error(f"HTTP Exception: {str(e)}")
         raise e
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logging.error(f"Unexpected error occurred: {str(e)}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
 
@@ -119,37 +171,28 @@ async def update_coin(
     current_user: Annotated[UserResponse, Depends(get_current_active_user)],
     from_coin_text_id: str,
     to_coin_text_id: str,
-    db: Session = Depends(get_db),
-    redis_conn: redis.StrictRedis = Depends(get_redis),
+    db: AsyncSession = Depends(get_db),
+    redis_conn: Redis = Depends(get_redis),
     currency: str = "usd",
 ):
     try:
-        user = db.query(User).filter(User.id == current_user.id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        actual_coin = db.query(Coin).filter(Coin.id_text == from_coin_text_id).first()
-        if not actual_coin:
-            raise HTTPException(status_code=404, detail="Actual coin not found")
-
-        new_coin = db.query(Coin).filter(Coin.id_text == to_coin_text_id).first()
-
-        if actual_coin in user.coins:
-            user.coins.remove(actual_coin)
-        else:
+        if not await remove_holding(db, current_user.id, from_coin_text_id):
+            if not await coin_exists(db, from_coin_text_id):
+                raise HTTPException(status_code=404, detail="Actual coin not found")
             raise HTTPException(status_code=404, detail="Actual coin data not assigned to portfolio")
 
-        if not new_coin:
+        if not await add_holding(db, current_user.id, to_coin_text_id):
+            if await coin_exists(db, to_coin_text_id):
+                raise HTTPException(status_code=409, detail="Coin already assigned to this user")
+
             coin_redis = await get_coin_by_id(to_coin_text_id, redis_conn)
             if not coin_redis:
                 raise HTTPException(status_code=404, detail="Coin data not found")
 
-            coin_price = await get_coin_price(to_coin_text_id)
-            if to_coin_text_id not in coin_price or currency not in coin_price[to_coin_text_id]:
+            price = await get_cached_price(to_coin_text_id, redis_conn, currency)
+            if price is None:
                 raise HTTPException(status_code=500, detail="Unable to fetch coin price")
 
-            price = coin_price.get(to_coin_text_id, {}).get(currency, 0.0)
-
             new_coin = Coin(
                 id_text=to_coin_text_id,
                 symbol=coin_redis.get("symbol"),
@@ -160,25 +203,27 @@ async def update_coin(
             new_coin.price = price
 
             db.add(new_coin)
+            await db.flush()
 
-        user.coins.append(new_coin)
+            await add_holding(db, current_user.id, to_coin_text_id)
 
-        db.commit()
+        await db.commit()
+        await bump_portfolio_version(current_user.id, redis_conn)
 
         return {"message": "Coin updated successfully in the user portfolio"}
 
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         logging.error(f"IntegrityError: {str(e)}")
         raise HTTPException(status_code=409, detail="Coin already assigned to this user")
 
     except HTTPException as e:
-        db.rollback()
+        await db.rollback()
         logging.error(f"HTTP Exception: {str(e)}")
         raise e
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logging.error(f"Unexpected error occurred: {str(e)}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
 
@@ -187,32 +232,92 @@ async def update_coin(
 async def remove_coin(
     current_user: Annotated[UserResponse, Depends(get_current_active_user)],
     coin_text_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
+    redis_conn: Redis = Depends(get_redis),
 ):
     try:
-        user = db.query(User).filter(User.id == current_user.id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        coin = db.query(Coin).filter(Coin.id_text == coin_text_id).first()
-        if not coin:
-            raise HTTPException(status_code=404, detail="Coin not found")
-
-        if coin in user.coins:
-            user.coins.remove(coin)
-        else:
+        if not await remove_holding(db, current_user.id, coin_text_id):
+            if not await coin_exists(db, coin_text_id):
+                raise HTTPException(status_code=404, detail="Coin not found")
             raise HTTPException(status_code=400, detail="Coin is not in user's portfolio")
 
-        db.commit()
+        await db.commit()
+        await bump_portfolio_version(current_user.id, redis_conn)
 
         return {"message": "Coin removed from user portfolio successfully"}
 
     except HTTPException as e:
-        db.rollback()
+        await db.rollback()
         logging.error(f"HTTP Exception: {str(e)}")
         raise e
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        logging.error(f"Unexpected error occurred: {str(e)}")
+        raise HTTPException(status_code=500, detail="An unexpected error occurred")
+
+
+@router.post("/coins/batch", response_model=CoinBatchResult)
+async def batch_coins(
+    current_user: Annotated[UserResponse, Depends(get_current_active_user)],
+    batch: CoinBatch,
+    db: AsyncSession = Depends(get_db),
+    redis_conn: Redis = Depends(get_redis),
+    currency: str = "usd",
+):
+    try:
+        # Operations are applied in order, all successful ones in a single transaction
+        result = await apply_operations(db, current_user.id, batch.operations, redis_conn, currency)
+        await db.commit()
+        if result["applied"]:
+            await bump_portfolio_version(current_user.id, redis_conn)
+
+        return result
+
+    except IntegrityError as e:
+        await db.rollback()
+        logging.error(f"IntegrityError: {str(e)}")
+        raise HTTPException(status_code=409, detail="Portfolio was changed concurrently, retry the batch")
+
+    except Exception as e:
+        await db.rollback()
+        logging.error(f"Unexpected error occurred: {str(e)}")
+        raise HTTPException(status_code=500, detail="An unexpected error occurred")
+
+
+@router.get("/coin/{coin_text_id}/history", response_model=PriceHistory)
+async def coin_price_history(
+    current_user: Annotated[UserResponse, Depends(get_current_active_user)],
+    coin_text_id: str,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    points: int = Query(500, gt=0, le=HISTORY_MAX_POINTS),
+    db: AsyncSession = Depends(get_db),
+):
+    end = to_utc_naive(end or datetime.now(timezone.utc))
+    start = to_utc_naive(start or end - timedelta(days=1))
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    try:
+        return await get_price_history(db, coin_text_id, start, end, points)
+
+    except Exception as e:
+        await db.rollback()
+        logging.error(f"Unexpected error occurred: {str(e)}")
+        raise HTTPException(status_code=500, detail="An unexpected error occurred")
+
+
+@router.get("/analytics", response_model=PortfolioAnalytics)
+async def portfolio_analytics(
+    current_user: Annotated[UserResponse, Depends(get_current_active_user)],
+    days: int = Query(30, gt=0, le=HISTORY_ANALYTICS_MAX_DAYS),
+    db: AsyncSession = Depends(get_db),
+):
+    try:
+        return await get_portfolio_analytics(db, current_user.id, days)
+
+    except Exception as e:
+        await db.rollback()
         logging.error(f"Unexpected error occurred: {str(e)}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
@@ -0,0 +1,81 @@
+import json
+from typing import Annotated
+
+import app.config as config
+from app.lib.auth import oauth2_scheme, resolve_principal
+from app.lib.holdings import get_holdings
+from app.lib.price_stream import price_stream
+from fastapi import (APIRouter, Depends, HTTPException, Query, Request,
+                     WebSocket, WebSocketDisconnect, status)
+from fastapi.responses import StreamingResponse
+
+router = APIRouter(prefix="/portfolio", tags=["Stream"])
+
+
+async def _portfolio_prices(token: str) -> dict:
+    """
+    Authenticate the client and read its holdings. Streams outlive the request,
+    so they use a short session of their own instead of holding a pooled connection.
+    """
+    async with config.SessionLocal() as db:
+        user = await resolve_principal(token, db)
+        coins = await get_holdings(db, user.id)
+    return {coin.id_text: float(coin.price) if coin.price is not None else None for coin in coins}
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.get("/prices/stream")
+async def stream_prices(request: Request, token: Annotated[str, Depends(oauth2_scheme)]):
+    """
+    Server-sent events: a snapshot of the portfolio prices, then a "prices"
+    event with the coins that changed whenever the price updater refreshes them.
+    """
+    snapshot = await _portfolio_prices(token)
+
+    async def events():
+        # Subscribe only once the response is streaming: a generator that never
+        # starts, because the client left first, never runs its finally
+        subscription = None
+        try:
+            subscription = price_stream.subscribe(snapshot)
+            yield _sse("snapshot", snapshot)
+            while not await request.is_disconnected():
+                prices = await subscription.next_prices(config.PRICE_STREAM_HEARTBEAT_SECONDS)
+                yield _sse("prices", prices) if prices else ": heartbeat\n\n"
+        finally:
+            if subscription is not None:
+                price_stream.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/prices/ws")
+async def stream_prices_ws(websocket: WebSocket, token: str = Query(...)):
+    """
+    WebSocket variant of /prices/stream. Browsers cannot set headers on
+    WebSocket requests, so the access token is passed as ?token=.
+    """
+    try:
+        snapshot = await _portfolio_prices(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    subscription = price_stream.subscribe(snapshot)
+    try:
+        await websocket.send_json({"event": "snapshot", "prices": snapshot})
+        while True:
+            prices = await subscription.next_prices(config.PRICE_STREAM_HEARTBEAT_SECONDS)
+            await websocket.send_json({"event": "prices", "prices": prices} if prices else {"event": "heartbeat"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        price_stream.unsubscribe(subscription)
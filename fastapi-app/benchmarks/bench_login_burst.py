@@ -0,0 +1,77 @@
+"""
+Benchmark of portfolio latency during a login burst.
+
+A probe coroutine stands in for portfolio traffic: it issues a short
+non-blocking wait every few milliseconds and records how late it completes.
+Meanwhile a burst of concurrent logins verifies bcrypt passwords either
+inline on the event loop (the old behaviour) or through the bounded password
+pool used by app.lib.auth. No database or Redis is needed:
+
+    DATABASE_URL=postgresql://unused python -m benchmarks.bench_login_burst
+"""
+
+import argparse
+import asyncio
+import json
+from statistics import quantiles
+from time import perf_counter
+
+from app.lib.auth import pwd_context, shutdown_password_pool, verify_password
+from fastapi import HTTPException
+
+PROBE_INTERVAL_MS = 5
+PROBE_IO_MS = 2
+
+
+async def probe(latencies: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = perf_counter()
+        await asyncio.sleep(PROBE_IO_MS / 1000)
+        latencies.append((perf_counter() - started) * 1000)
+        await asyncio.sleep(PROBE_INTERVAL_MS / 1000)
+
+
+async def inline_login(password: str, hashed: str):
+    # What POST /token did before: bcrypt directly on the event loop
+    return pwd_context.verify(password, hashed)
+
+
+async def run(mode: str, logins: int, hashed: str):
+    login = inline_login if mode == "inline" else verify_password
+    latencies = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(latencies, stop))
+    await asyncio.sleep(0.05)
+
+    started = perf_counter()
+    results = await asyncio.gather(*(login("secret", hashed) for _ in range(logins)), return_exceptions=True)
+    burst_s = perf_counter() - started
+
+    stop.set()
+    await probe_task
+    rejected = sum(isinstance(result, HTTPException) and result.status_code == 503 for result in results)
+    cuts = quantiles(latencies, n=100, method="inclusive")
+    return {
+        "mode": mode,
+        "logins": logins,
+        "rejected_503": rejected,
+        "burst_s": round(burst_s, 2),
+        "probe_p50_ms": round(cuts[49], 2),
+        "probe_p99_ms": round(cuts[98], 2),
+        "probe_max_ms": round(max(latencies), 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=50)
+    args = parser.parse_args()
+
+    hashed = pwd_context.hash("secret")
+    results = [await run(mode, args.logins, hashed) for mode in ("inline", "pool")]
+    shutdown_password_pool()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+"""
+Benchmark of the in-memory typeahead index.
+
+Builds the index over a synthetic catalogue the size of CoinGecko's coins/list
+(or over a coins/list JSON dump passed with --catalogue) and reports the build
+time and per-query latency for exact, prefix and misspelled queries:
+
+    DATABASE_URL=postgresql://unused python -m benchmarks.bench_search_index
+"""
+
+import argparse
+import json
+import random
+import string
+from statistics import quantiles
+from time import perf_counter
+
+from app.lib.search_index import SearchIndex
+
+QUERIES = {
+    "exact": ["btc", "eth", "usdt", "sol", "doge"],
+    "prefix": ["b", "et", "bit", "doge", "sh"],
+    "typo": ["bitcon", "etherum", "solan", "dogecon", "chainlnk"],
+}
+
+KNOWN_COINS = [
+    ("bitcoin", "btc", "Bitcoin"),
+    ("ethereum", "eth", "Ethereum"),
+    ("tether", "usdt", "Tether"),
+    ("solana", "sol", "Solana"),
+    ("dogecoin", "doge", "Dogecoin"),
+    ("chainlink", "link", "Chainlink"),
+]
+
+
+def synthetic_catalogue(size: int, rng: random.Random):
+    coins = list(KNOWN_COINS)
+    while len(coins) < size:
+        symbol = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 6)))
+        words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))).capitalize() for _ in range(2)]
+        coins.append((f"{words[0].lower()}-{words[1].lower()}-{len(coins)}", symbol, " ".join(words)))
+    return coins
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=15000)
+    parser.add_argument("--catalogue", help="coins/list JSON dump to index instead of synthetic data")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.catalogue:
+        with open(args.catalogue) as f:
+            coins = [(coin["id"], coin["symbol"], coin["name"]) for coin in json.load(f)]
+    else:
+        coins = synthetic_catalogue(args.size, random.Random(42))
+
+    started = perf_counter()
+    index = SearchIndex(coins, generation="bench")
+    results = {"coins": len(index), "build_ms": round((perf_counter() - started) * 1000, 1), "queries": {}}
+
+    for kind, queries in QUERIES.items():
+        timings = []
+        for i in range(args.iterations):
+            query = queries[i % len(queries)]
+            started = perf_counter()
+            index.search(query, limit=10)
+            timings.append((perf_counter() - started) * 1000)
+        cuts = quantiles(timings, n=100)
+        results["queries"][kind] = {"p50_ms": round(cuts[49], 4), "p99_ms": round(cuts[98], 4)}
+
+    results["examples"] = {query: index.search(query, limit=3) for query in ("btc", "bit", "etherum")}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
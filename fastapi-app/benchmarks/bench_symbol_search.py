@@ -0,0 +1,101 @@
+"""
+Micro-benchmark for the symbol search path.
+
+Compares the old N+1 lookup (SMEMBERS + one HGETALL per member) with the
+single-round-trip Lua lookup used by get_coins_by_symbol, for symbols shared
+by a growing number of coins.
+
+Run from the fastapi-app directory against a local Redis:
+
+    DATABASE_URL=postgresql://unused REDIS_HOST=localhost python -m benchmarks.bench_symbol_search
+"""
+
+import argparse
+import asyncio
+import json
+from statistics import quantiles
+from time import perf_counter
+
+import app.config as config
+import redis.asyncio as redis
+from app.lib.redis import bulk_load_coins, coin_key, get_coins_by_symbol, symbol_key
+
+BENCH_GENERATION = "bench"
+
+
+class CountingConnection(redis.Connection):
+    """Counts packed sends, i.e. network round trips (a pipeline counts once)."""
+
+    round_trips = 0
+
+    async def send_packed_command(self, command, check_health=True):
+        CountingConnection.round_trips += 1
+        return await super().send_packed_command(command, check_health)
+
+
+async def legacy_get_coins_by_symbol(symbol, redis_conn):
+    generation = await redis_conn.get(config.CATALOGUE_CURRENT_KEY)
+    coin_ids = await redis_conn.smembers(symbol_key(generation, symbol))
+    coins = []
+    for coin_id in coin_ids:
+        coins.append(await redis_conn.hgetall(coin_key(generation, coin_id)))
+    return coins
+
+
+async def measure(lookup, symbol, redis_conn, iterations):
+    timings = []
+    CountingConnection.round_trips = 0
+    for _ in range(iterations):
+        started = perf_counter()
+        await lookup(symbol, redis_conn)
+        timings.append((perf_counter() - started) * 1000)
+    cuts = quantiles(timings, n=100)
+    return {
+        "round_trips_per_query": CountingConnection.round_trips / iterations,
+        "p50_ms": round(cuts[49], 3),
+        "p99_ms": round(cuts[98], 3),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,10,50,200", help="coins per symbol to benchmark")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    pool = redis.ConnectionPool(
+        host=config.REDIS_HOST,
+        port=config.REDIS_PORT,
+        db=config.REDIS_DB,
+        decode_responses=True,
+        connection_class=CountingConnection,
+    )
+    redis_conn = redis.Redis(connection_pool=pool)
+    previous_generation = await redis_conn.get(config.CATALOGUE_CURRENT_KEY)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    coins = [(f"bench-{size}-{i}", f"bench{size}", f"Bench {size} #{i}") for size in sizes for i in range(size)]
+    await bulk_load_coins(coins, redis_conn, BENCH_GENERATION)
+    await redis_conn.set(config.CATALOGUE_CURRENT_KEY, BENCH_GENERATION)
+
+    results = []
+    try:
+        for size in sizes:
+            symbol = f"bench{size}"
+            for name, lookup in (("before", legacy_get_coins_by_symbol), ("after", get_coins_by_symbol)):
+                result = await measure(lookup, symbol, redis_conn, args.iterations)
+                results.append({"coins_per_symbol": size, "variant": name, **result})
+    finally:
+        if previous_generation is not None:
+            await redis_conn.set(config.CATALOGUE_CURRENT_KEY, previous_generation)
+        else:
+            await redis_conn.delete(config.CATALOGUE_CURRENT_KEY)
+        async for key in redis_conn.scan_iter(match=f"*:{BENCH_GENERATION}:*"):
+            await redis_conn.unlink(key)
+        await redis_conn.aclose(close_connection_pool=True)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,166 @@
+"""
+Local stand-in for the parts of the CoinGecko API the project uses:
+
+    GET /coins/list      synthetic catalogue of --coins coins
+    GET /simple/price    deterministic prices, a share of them moving on every call
+    GET /__stats         request counters, for the benchmark runner
+
+Every response can be delayed by --latency-ms, and --rate-limit-ratio of the
+requests are answered with 429 and a Retry-After header. benchmarks.suite
+starts one in-process; to run it standalone from the fastapi-app directory
+and point API_COIN_URL at it:
+
+    python -m benchmarks.fake_coingecko --port 8900 --coins 15000 --latency-ms 50
+"""
+
+import argparse
+import json
+import random
+import string
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from urllib.parse import parse_qs, urlparse
+
+KNOWN_COINS = [
+    ("bitcoin", "btc", "Bitcoin"),
+    ("ethereum", "eth", "Ethereum"),
+    ("tether", "usdt", "Tether"),
+    ("solana", "sol", "Solana"),
+    ("dogecoin", "doge", "Dogecoin"),
+]
+
+
+def synthetic_catalogue(size: int, seed: int = 42):
+    """
+    Known coins followed by random ones. About one symbol in ten is shared by
+    several coins, like the wrapped and bridged tokens of the real catalogue.
+    """
+    rng = random.Random(seed)
+    coins = list(KNOWN_COINS[:size])
+    symbols = []
+    while len(coins) < size:
+        if symbols and rng.random() < 0.1:
+            symbol = rng.choice(symbols)
+        else:
+            symbol = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 5)))
+            symbols.append(symbol)
+        words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 8))).capitalize() for _ in range(2)]
+        coins.append((f"{words[0].lower()}-{words[1].lower()}-{len(coins)}", symbol, " ".join(words)))
+    return coins
+
+
+class FakeCoinGecko(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, coins: int, latency_ms: float, rate_limit_ratio: float, change_ratio: float, seed=42):
+        super().__init__(address, FakeCoinGeckoHandler)
+        self.catalogue = synthetic_catalogue(coins, seed)
+        self.catalogue_body = json.dumps(
+            [{"id": id_text, "symbol": symbol, "name": name} for id_text, symbol, name in self.catalogue]
+        ).encode()
+        self.known_ids = {id_text for id_text, _, _ in self.catalogue}
+        self.latency_ms = latency_ms
+        self.rate_limit_ratio = rate_limit_ratio
+        self.change_ratio = change_ratio
+        self.rng = random.Random(seed)
+        self.prices = {}
+        self.lock = threading.Lock()
+        self.stats = {"coins_list": 0, "simple_price": 0, "ids_priced": 0, "rate_limited": 0}
+
+    def price_of(self, coin_id: str) -> float:
+        # Called with the lock held
+        price = self.prices.get(coin_id)
+        if price is None:
+            price = round(self.rng.uniform(0.001, 50000), 6)
+        elif self.rng.random() < self.change_ratio:
+            price = round(price * self.rng.uniform(0.98, 1.02), 6)
+        self.prices[coin_id] = price
+        return price
+
+    def reset_stats(self):
+        with self.lock:
+            for key in self.stats:
+                self.stats[key] = 0
+
+
+class FakeCoinGeckoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        path = url.path.rstrip("/").rsplit("/", 2)[-2:]
+
+        if path[-1] == "__stats":
+            with server.lock:
+                return self._send(200, json.dumps(server.stats).encode())
+
+        if server.latency_ms:
+            sleep(server.latency_ms / 1000)
+
+        with server.lock:
+            limited = server.rng.random() < server.rate_limit_ratio
+            if limited:
+                server.stats["rate_limited"] += 1
+        if limited:
+            return self._send(429, b'{"status": {"error_code": 429}}', {"Retry-After": "1"})
+
+        if path == ["coins", "list"]:
+            with server.lock:
+                server.stats["coins_list"] += 1
+            return self._send(200, server.catalogue_body)
+
+        if path[-1] == "price":
+            params = parse_qs(url.query)
+            ids = [coin_id for coin_id in params.get("ids", [""])[0].split(",") if coin_id in server.known_ids]
+            currency = params.get("vs_currencies", ["usd"])[0]
+            with server.lock:
+                server.stats["simple_price"] += 1
+                server.stats["ids_priced"] += len(ids)
+                prices = {coin_id: {currency: server.price_of(coin_id)} for coin_id in ids}
+            return self._send(200, json.dumps(prices).encode())
+
+        self._send(404, b'{"error": "not found"}')
+
+
+def start(port=0, coins=15000, latency_ms=0.0, rate_limit_ratio=0.0, change_ratio=0.3):
+    """
+    Start the server on a background thread. Returns it; its base URL is
+    f"http://127.0.0.1:{server.server_port}/".
+    """
+    server = FakeCoinGecko(("127.0.0.1", port), coins, latency_ms, rate_limit_ratio, change_ratio)
+    threading.Thread(target=server.serve_forever, name="fake-coingecko", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--coins", type=int, default=15000)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--change-ratio", type=float, default=0.3, help="share of prices that move between calls")
+    args = parser.parse_args()
+
+    server = FakeCoinGecko(
+        ("127.0.0.1", args.port), args.coins, args.latency_ms, args.rate_limit_ratio, args.change_ratio
+    )
+    print(f"Fake CoinGecko serving {args.coins} coins on http://127.0.0.1:{args.port}/")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
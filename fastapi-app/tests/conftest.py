@@ -0,0 +1,33 @@
+import os
+import tempfile
+
+# app.config reads the environment on import. Tests run against a throwaway
+# SQLite file unless DATABASE_URL points somewhere else.
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.gettempdir()}/coin-crypto-tests.db")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+import app.config as config
+import app.db.schema  # noqa: F401  registers the tables on Base
+import pytest
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db():
+    """
+    Session on freshly created tables, dropped again after the test.
+    """
+    async with config.engine.begin() as conn:
+        await conn.run_sync(config.Base.metadata.drop_all)
+        await conn.run_sync(config.Base.metadata.create_all)
+    async with config.SessionLocal() as session:
+        yield session
+    async with config.engine.begin() as conn:
+        await conn.run_sync(config.Base.metadata.drop_all)
+    # Every test runs on its own event loop, pooled connections must not outlive it
+    await config.engine.dispose()
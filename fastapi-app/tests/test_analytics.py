@@ -0,0 +1,54 @@
+import numpy as np
+from app.lib.analytics import (DAILY, SECONDS_PER_YEAR, align_closes,
+                               build_analytics, compute_analytics)
+
+
+class Holding:
+    def __init__(self, id_text, price):
+        self.id_text = self.symbol = self.name = id_text
+        self.price = price
+
+
+def test_align_closes_forward_fills_and_reports_observed():
+    matrix, observed = align_closes(
+        np.array([0, 0, 1]), np.array([0, 2, 1]), np.array([1.0, 3.0, 5.0]), n_coins=2, n_buckets=4
+    )
+    np.testing.assert_array_equal(matrix, [[1.0, 1.0, 3.0, 3.0], [np.nan, 5.0, 5.0, 5.0]])
+    np.testing.assert_array_equal(observed, [[True, False, True, False], [False, True, False, False]])
+
+
+def test_filled_buckets_are_not_zero_returns():
+    log_closes = np.array([0.0, 0.02, 0.0, 0.0, 0.01, 0.04, 0.0])
+    # Buckets 2, 3 and 6 are missing
+    bucket_indexes = np.array([0, 1, 4, 5])
+    coin_indexes = np.zeros(len(bucket_indexes), dtype=np.intp)
+    matrix, observed = align_closes(coin_indexes, bucket_indexes, np.exp(log_closes[bucket_indexes]), 1, 7)
+
+    metrics = compute_analytics(np.array([1.0]), matrix, observed, DAILY)
+
+    # Only the moves between two observed buckets count
+    expected = np.std([0.02, 0.03], ddof=1) * np.sqrt(SECONDS_PER_YEAR / DAILY)
+    np.testing.assert_allclose(metrics["volatility"], [expected])
+    # Changes read the forward-filled closes: the last bucket repeats the one before
+    assert metrics["change_24h"][0] == 0.0
+
+
+def test_build_analytics_from_loaded_rows():
+    holdings = [Holding("bitcoin", 100.0), Holding("ethereum", 300.0), Holding("fresh", 1.0)]
+    rng = np.random.default_rng(0)
+    n_buckets = 30
+    series = [
+        (coin_id, [bucket * DAILY for bucket in range(n_buckets)], list(100 * np.exp(rng.normal(0, 0.01, n_buckets))))
+        for coin_id in ("ethereum", "bitcoin")
+    ]
+
+    analytics = build_analytics(holdings, series, 0, n_buckets, DAILY)
+
+    assert analytics["total_value"] == 401.0
+    assert [holding["weight"] for holding in analytics["holdings"]] == [100 / 401, 300 / 401, 1 / 401]
+    assert analytics["holdings"][0]["change_7d"] is not None
+    assert analytics["holdings"][2]["volatility"] is None
+    assert analytics["correlation"]["ids"] == ["bitcoin", "ethereum", "fresh"]
+    matrix = analytics["correlation"]["matrix"]
+    assert matrix[0][0] == 1.0 and matrix[0][1] == matrix[1][0]
+    assert matrix[2] == [None, None, None]
@@ -0,0 +1,58 @@
+import app.lib.price_cache as price_cache
+import pytest
+from app.db.schema import Coin, User
+from app.lib.holdings import apply_operations, get_holdings
+from app.lib.redis import bulk_load_coins, publish_catalogue_generation
+from app.models.portfolio import CoinOperation
+from fakeredis import FakeAsyncRedis
+from sqlalchemy import insert, select
+
+pytestmark = pytest.mark.anyio
+
+CATALOGUE = [("bitcoin", "btc", "Bitcoin"), ("ethereum", "eth", "Ethereum"), ("delisted", "dls", "Delisted")]
+
+
+@pytest.fixture
+async def redis_conn():
+    redis_conn = FakeAsyncRedis(decode_responses=True)
+    await bulk_load_coins(CATALOGUE, redis_conn, 1)
+    await publish_catalogue_generation(1, redis_conn)
+    yield redis_conn
+    await redis_conn.aclose()
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """
+    Coin ids priced through the batcher, i.e. sent to CoinGecko.
+    """
+    requested = []
+
+    async def get_price(coin_id, currency="usd"):
+        requested.append(coin_id)
+        return {"ethereum": 3000.0}.get(coin_id)
+
+    monkeypatch.setattr(price_cache.price_batcher, "get_price", get_price)
+    monkeypatch.setattr(price_cache, "_local_prices", type(price_cache._local_prices)())
+    return requested
+
+
+async def test_batch_adds_read_prices_through_the_cache(db, redis_conn, upstream):
+    await db.execute(insert(User).values(id=1, email="user@example.com", password="hash"))
+    await db.commit()
+    await redis_conn.set(price_cache.price_key("bitcoin", "usd"), 60000.0)
+
+    operations = [CoinOperation(op="add", id_text=coin_id) for coin_id in ("bitcoin", "ethereum", "delisted")]
+    result = await apply_operations(db, 1, operations, redis_conn)
+    await db.commit()
+
+    assert [item["status"] for item in result["results"]] == [200, 200, 500]
+    assert result["results"][2]["detail"] == "Unable to fetch coin price"
+    assert result["applied"] == 2
+    # Cached prices never reach CoinGecko, fetched ones are written back
+    assert sorted(upstream) == ["delisted", "ethereum"]
+    assert await redis_conn.get(price_cache.price_key("ethereum", "usd")) == "3000.0"
+
+    assert [coin.id_text for coin in await get_holdings(db, 1)] == ["bitcoin", "ethereum"]
+    stored = dict((await db.execute(select(Coin.id_text, Coin.price))).all())
+    assert stored == {"bitcoin": 60000.0, "ethereum": 3000.0}
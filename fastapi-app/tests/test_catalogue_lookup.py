@@ -0,0 +1,52 @@
+import app.lib.redis as redis_lib
+import pytest
+from fakeredis import FakeAsyncRedis
+
+pytestmark = pytest.mark.anyio
+
+COINS = [("bitcoin", "btc", "Bitcoin"), ("ethereum", "eth", "Ethereum"), ("ether-token", "eth", "Ether Token")]
+
+
+class CountingRedis(FakeAsyncRedis):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.commands = []
+
+    async def execute_command(self, *args, **options):
+        self.commands.append(str(args[0]).upper())
+        return await super().execute_command(*args, **options)
+
+
+@pytest.fixture
+async def redis_conn():
+    redis_conn = CountingRedis(decode_responses=True)
+    generation = await redis_conn.incr("catalogue:sequence")
+    await redis_lib.bulk_load_coins(COINS, redis_conn, generation)
+    await redis_lib.publish_catalogue_generation(generation, redis_conn)
+    await redis_conn.script_flush()
+    yield redis_conn
+    await redis_conn.aclose()
+
+
+async def test_scripts_loaded_once_then_one_round_trip(redis_conn):
+    redis_conn.commands.clear()
+    assert (await redis_lib.get_coin_by_id("bitcoin", redis_conn))["name"] == "Bitcoin"
+    assert redis_conn.commands == ["EVALSHA", "SCRIPT LOAD", "EVALSHA"]
+
+    for _ in range(3):
+        redis_conn.commands.clear()
+        assert (await redis_lib.get_coin_by_id("bitcoin", redis_conn))["name"] == "Bitcoin"
+        assert redis_conn.commands == ["EVALSHA"]
+
+
+async def test_coins_by_symbol(redis_conn):
+    coins = await redis_lib.get_coins_by_symbol("eth", redis_conn)
+    assert sorted(coin["id_text"] for coin in coins) == ["ether-token", "ethereum"]
+    assert await redis_lib.get_coins_by_symbol("doge", redis_conn) == []
+
+
+async def test_lookups_before_first_load():
+    redis_conn = FakeAsyncRedis(decode_responses=True)
+    assert await redis_lib.get_coin_by_id("bitcoin", redis_conn) == {}
+    assert await redis_lib.get_coins_by_symbol("btc", redis_conn) == []
+    await redis_conn.aclose()
@@ -0,0 +1,59 @@
+import app.config as config
+import app.lib.redis as redis_lib
+import pytest
+from fakeredis import FakeAsyncRedis
+
+pytestmark = pytest.mark.anyio
+
+COINS = [("bitcoin", "btc", "Bitcoin"), ("ethereum", "eth", "Ethereum")]
+
+
+@pytest.fixture
+async def redis_conn(monkeypatch):
+    async def download_coins_list_data():
+        return COINS
+
+    monkeypatch.setattr(redis_lib, "download_coins_list_data", download_coins_list_data)
+    monkeypatch.setattr(config, "CATALOGUE_PURGE_DELAY_SECONDS", 0)
+    redis_conn = FakeAsyncRedis(decode_responses=True)
+    yield redis_conn
+    await redis_conn.aclose()
+
+
+async def test_consecutive_refreshes_are_not_skipped(redis_conn):
+    assert await redis_lib.refresh_catalogue_locked(redis_conn) == 1
+    assert await redis_conn.get(config.CATALOGUE_REFRESH_LOCK_KEY) is None
+    assert await redis_lib.refresh_catalogue_locked(redis_conn) == 2
+    assert await redis_lib.get_coin_by_id("bitcoin", redis_conn) == {
+        "id_text": "bitcoin",
+        "name": "Bitcoin",
+        "symbol": "btc",
+    }
+
+
+async def test_refresh_skipped_while_another_worker_holds_the_lock(redis_conn):
+    await redis_conn.set(config.CATALOGUE_REFRESH_LOCK_KEY, "other-worker")
+    assert await redis_lib.refresh_catalogue_locked(redis_conn) is None
+    assert await redis_lib.get_catalogue_generation(redis_conn) is None
+    assert await redis_conn.get(config.CATALOGUE_REFRESH_LOCK_KEY) == "other-worker"
+
+
+async def test_lock_released_when_the_refresh_fails(redis_conn, monkeypatch):
+    async def download_coins_list_data():
+        raise RuntimeError("CoinGecko is down")
+
+    monkeypatch.setattr(redis_lib, "download_coins_list_data", download_coins_list_data)
+    with pytest.raises(RuntimeError):
+        await redis_lib.refresh_catalogue_locked(redis_conn)
+    assert await redis_conn.get(config.CATALOGUE_REFRESH_LOCK_KEY) is None
+
+
+async def test_lock_taken_over_after_expiry_is_kept(redis_conn, monkeypatch):
+    async def download_coins_list_data():
+        # The lock expired during a slow load and another worker took it
+        await redis_conn.set(config.CATALOGUE_REFRESH_LOCK_KEY, "other-worker")
+        return COINS
+
+    monkeypatch.setattr(redis_lib, "download_coins_list_data", download_coins_list_data)
+    assert await redis_lib.refresh_catalogue_locked(redis_conn) == 1
+    assert await redis_conn.get(config.CATALOGUE_REFRESH_LOCK_KEY) == "other-worker"
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+from app.lib.auth import get_current_active_user
+from app.lib.history import to_utc_naive
+from app.main import app
+from app.models.user import UserResponse
+
+pytestmark = pytest.mark.anyio
+
+
+def test_to_utc_naive():
+    naive = datetime(2026, 1, 1, 12, 0)
+    assert to_utc_naive(naive) == naive
+    assert to_utc_naive(datetime(2026, 1, 1, 12, 0, tzinfo=timezone.utc)) == naive
+    assert to_utc_naive(datetime(2026, 1, 1, 14, 0, tzinfo=timezone(timedelta(hours=2)))) == naive
+
+
+@pytest.fixture
+async def client(db):
+    app.dependency_overrides[get_current_active_user] = lambda: UserResponse(id=1, email="user@example.com")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+    app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"start": "2026-01-01T00:00:00"},
+        {"start": "2026-01-01T00:00:00+00:00"},
+        {"start": "2026-01-01T00:00:00", "end": "2026-01-02T00:00:00"},
+        {"start": "2026-01-01T00:00:00+02:00", "end": "2026-01-02T00:00:00+02:00"},
+        {"start": "2026-01-01T00:00:00", "end": "2026-01-02T00:00:00+00:00"},
+        {"start": "2026-01-01T00:00:00+00:00", "end": "2026-01-02T00:00:00"},
+        {"end": "2026-01-02T00:00:00"},
+    ],
+    ids=["naive-start", "aware-start", "naive", "aware", "naive-start-aware-end", "aware-start-naive-end", "naive-end"],
+)
+async def test_history_bounds(client, params):
+    response = await client.get("/portfolio/coin/bitcoin/history", params=params)
+    assert response.status_code == 200
+    assert response.json()["points"] == []
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"start": "2026-01-02T00:00:00", "end": "2026-01-01T00:00:00"},
+        # Same instant, 02:00 at UTC+2 is midnight UTC
+        {"start": "2026-01-01T00:00:00", "end": "2026-01-01T02:00:00+02:00"},
+        {"start": "2026-01-01T01:00:00+00:00", "end": "2026-01-01T00:30:00"},
+    ],
+)
+async def test_history_start_after_end(client, params):
+    response = await client.get("/portfolio/coin/bitcoin/history", params=params)
+    assert response.status_code == 400
+    assert response.json() == {"detail": "start must be before end"}
@@ -0,0 +1,67 @@
+import pytest
+from app.config import engine
+from app.db.schema import Coin, User, user_coin_association
+from app.lib.holdings import add_holding, get_holdings, remove_holding
+from sqlalchemy import event, insert
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def statements():
+    """
+    SQL statements sent to the database while the test runs.
+    """
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        executed.append(" ".join(statement.split()))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    yield executed
+    event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+async def _portfolio(db, holdings):
+    """
+    A user holding the first `holdings` of holdings + 1 stored coins, the last one is left to add.
+    """
+    coins = [{"id_text": f"coin-{i:05}", "symbol": f"c{i}", "name": f"Coin {i}"} for i in range(holdings + 1)]
+    await db.execute(insert(User).values(id=1, email="user@example.com", password="hash"))
+    await db.execute(insert(Coin), coins)
+    if holdings:
+        await db.execute(
+            insert(user_coin_association), [{"user_id": 1, "coin_id_text": coin["id_text"]} for coin in coins[:-1]]
+        )
+    await db.commit()
+    return coins[-1]["id_text"]
+
+
+@pytest.mark.parametrize("holdings", [0, 1, 5000])
+async def test_statements_per_operation(db, statements, holdings):
+    new_coin = await _portfolio(db, holdings)
+
+    statements.clear()
+    assert len(await get_holdings(db, 1)) == holdings
+    assert len(statements) == 1 and statements[0].startswith("SELECT")
+
+    statements.clear()
+    assert await add_holding(db, 1, new_coin)
+    assert len(statements) == 1
+    assert statements[0].startswith("INSERT") and "ON CONFLICT DO NOTHING" in statements[0]
+
+    statements.clear()
+    assert await remove_holding(db, 1, new_coin)
+    assert len(statements) == 1
+    assert statements[0].startswith("DELETE") and "RETURNING" in statements[0]
+
+
+async def test_no_op_writes_are_single_statements(db, statements):
+    await _portfolio(db, 1)
+
+    statements.clear()
+    # Already held, then not stored at all
+    assert not await add_holding(db, 1, "coin-00000")
+    assert not await add_holding(db, 1, "unknown")
+    assert not await remove_holding(db, 1, "coin-00001")
+    assert [statement.split()[0] for statement in statements] == ["INSERT", "INSERT", "DELETE"]
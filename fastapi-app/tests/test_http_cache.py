@@ -0,0 +1,34 @@
+import pytest
+from app.lib.http_cache import (bump_portfolio_version, get_portfolio_etag,
+                                portfolio_version_key)
+from fakeredis import FakeAsyncRedis
+from redis.exceptions import ConnectionError
+
+pytestmark = pytest.mark.anyio
+
+
+class FailingIncrRedis(FakeAsyncRedis):
+    async def incr(self, name, amount=1):
+        raise ConnectionError("Connection reset by peer")
+
+
+async def test_etag_follows_counters_and_fingerprint():
+    redis_conn = FakeAsyncRedis(decode_responses=True)
+    etag = await get_portfolio_etag(1, redis_conn, "aaaa")
+    assert etag == 'W/"p0-0-aaaa"'
+
+    await bump_portfolio_version(1, redis_conn)
+    assert await get_portfolio_etag(1, redis_conn, "aaaa") == 'W/"p1-0-aaaa"'
+
+    # Redis lost its data: the counters are back at 0, the contents tell the tags apart
+    await redis_conn.flushall()
+    assert await get_portfolio_etag(1, redis_conn, "bbbb") != etag
+    await redis_conn.aclose()
+
+
+async def test_failed_bump_drops_the_version():
+    redis_conn = FailingIncrRedis(decode_responses=True)
+    await redis_conn.set(portfolio_version_key(1), 3)
+    await bump_portfolio_version(1, redis_conn)
+    assert await redis_conn.get(portfolio_version_key(1)) is None
+    await redis_conn.aclose()
@@ -0,0 +1,45 @@
+import app.config as config
+import httpx
+import pytest
+from app.lib.metrics import REQUEST_DURATION, MetricsMiddleware
+from app.main import app
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+pytestmark = pytest.mark.anyio
+
+
+def _observed(route):
+    for metric in REQUEST_DURATION.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_count") and sample.labels["route"] == route:
+                return sample.value
+    return 0
+
+
+async def test_event_streams_are_not_observed():
+    stream_app = FastAPI()
+    stream_app.add_middleware(MetricsMiddleware)
+
+    @stream_app.get("/test/events")
+    async def events():
+        return StreamingResponse(iter(["data: 1\n\n"]), media_type="text/event-stream")
+
+    @stream_app.get("/test/json")
+    async def json_response():
+        return {"ok": True}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=stream_app), base_url="http://test") as client:
+        await client.get("/test/events")
+        await client.get("/test/json")
+
+    assert _observed("/test/events") == 0
+    assert _observed("/test/json") == 1
+
+
+async def test_metrics_require_the_api_key():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        assert (await client.get("/metrics")).status_code == 403
+        response = await client.get("/metrics", headers={"X-API-KEY": config.API_KEY})
+    assert response.status_code == 200
+    assert "http_request_duration_seconds" in response.text
@@ -0,0 +1,51 @@
+import app.lib.price_cache as price_cache
+import pytest
+from fakeredis import FakeAsyncRedis
+
+pytestmark = pytest.mark.anyio
+
+LOCK_KEY = price_cache.price_lock_key("bitcoin", "usd")
+
+
+@pytest.fixture
+async def redis_conn(monkeypatch):
+    monkeypatch.setattr(price_cache, "_local_prices", type(price_cache._local_prices)())
+    redis_conn = FakeAsyncRedis(decode_responses=True)
+    yield redis_conn
+    await redis_conn.aclose()
+
+
+def _upstream(monkeypatch, get_price):
+    monkeypatch.setattr(price_cache.price_batcher, "get_price", get_price)
+
+
+async def test_lock_released_after_the_fetch(redis_conn, monkeypatch):
+    async def get_price(coin_id, currency="usd"):
+        assert await redis_conn.get(LOCK_KEY) is not None
+        return 60000.0
+
+    _upstream(monkeypatch, get_price)
+    assert await price_cache.get_cached_price("bitcoin", redis_conn) == 60000.0
+    assert await redis_conn.get(LOCK_KEY) is None
+    assert await redis_conn.get(price_cache.price_key("bitcoin", "usd")) == "60000.0"
+
+
+async def test_lock_released_when_the_fetch_fails(redis_conn, monkeypatch):
+    async def get_price(coin_id, currency="usd"):
+        raise RuntimeError("CoinGecko is down")
+
+    _upstream(monkeypatch, get_price)
+    with pytest.raises(RuntimeError):
+        await price_cache.get_cached_price("bitcoin", redis_conn)
+    assert await redis_conn.get(LOCK_KEY) is None
+
+
+async def test_lock_taken_over_after_expiry_is_kept(redis_conn, monkeypatch):
+    async def get_price(coin_id, currency="usd"):
+        # The lock expired during a slow call and another worker took it
+        await redis_conn.set(LOCK_KEY, "other-worker")
+        return 60000.0
+
+    _upstream(monkeypatch, get_price)
+    assert await price_cache.get_cached_price("bitcoin", redis_conn) == 60000.0
+    assert await redis_conn.get(LOCK_KEY) == "other-worker"
@@ -0,0 +1,40 @@
+import app.routers.stream as stream
+import pytest
+from app.lib.price_stream import price_stream
+
+pytestmark = pytest.mark.anyio
+
+
+class ConnectedRequest:
+    async def is_disconnected(self):
+        return False
+
+
+@pytest.fixture(autouse=True)
+def portfolio(monkeypatch):
+    async def _portfolio_prices(token):
+        return {"bitcoin": 100.0, "ethereum": 10.0}
+
+    monkeypatch.setattr(stream, "_portfolio_prices", _portfolio_prices)
+
+
+def _subscriptions():
+    return price_stream.get_stats()["subscriptions"]
+
+
+async def test_stream_not_started_does_not_subscribe():
+    before = _subscriptions()
+    response = await stream.stream_prices(ConnectedRequest(), "token")
+    assert _subscriptions() == before
+    # The client left before the body was sent
+    await response.body_iterator.aclose()
+    assert _subscriptions() == before
+
+
+async def test_stream_unsubscribes_when_closed():
+    before = _subscriptions()
+    response = await stream.stream_prices(ConnectedRequest(), "token")
+    assert (await anext(response.body_iterator)).startswith("event: snapshot\n")
+    assert _subscriptions() == before + 1
+    await response.body_iterator.aclose()
+    assert _subscriptions() == before
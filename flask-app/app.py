@@ -1,12 +1,10 @@
-import jsonify
+import backend
 import requests
-from flask import (Flask, make_response, redirect, render_template, request,
-                   url_for)
+from flask import (Flask, jsonify, make_response, redirect, render_template,
+                   request, url_for)
 
 app = Flask("FlaskApp")
 
-FASTAPI_URL = "http://fastapi-app:8000"
-
 
 @app.route("/")
 def index():
@@ -31,7 +29,7 @@ def login():
         data = {"username": username, "password": password}
 
         try:
-            response = requests.post(FASTAPI_URL + "/token", data=data)
+            response = backend.post("/token", data=data)
 
             # Check response
             if response.status_code == 200:
@@ -64,7 +62,7 @@ def register():
         data = {"username": email, "password": password}
 
         try:
-            response = requests.post(FASTAPI_URL + "/register", data=data)
+            response = backend.post("/register", data=data)
 
             if response.status_code == 200:
                 return redirect(url_for("login"))
@@ -85,17 +83,15 @@ def dashboard():
     if not access_token:
         return redirect(url_for("login"))
 
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(FASTAPI_URL + "/portfolio/coin/", headers=headers)
+    try:
+        status_code, items = backend.get_json("/portfolio/coin/", access_token)
+    except requests.exceptions.RequestException:
+        status_code, items = None, None
 
-    if response.status_code == 200:
-        items = response.json()
-    elif response.status_code == 401:
+    if status_code == 401:
         return redirect(url_for("login"))
-    else:
-        items = []
 
-    return render_template("dashboard.html", items=items)
+    return render_template("dashboard.html", items=items or [])
 
 
 @app.route("/search", methods=["GET", "POST"])
@@ -112,15 +108,16 @@ def search():
         if not access_token:
             return redirect(url_for("login"))
 
-        headers = {"Authorization": f"Bearer {access_token}"}
-        response = requests.get(FASTAPI_URL + "/portfolio/coin/search/?coin_cymbol=" + symbol, headers=headers)
+        try:
+            status_code, search_results = backend.get_json(
+                "/portfolio/coin/search/", access_token, params={"coin_cymbol": symbol}
+            )
+        except requests.exceptions.RequestException:
+            return render_template("dashboard.html", search_results=[])
 
-        if response.status_code == 200:
-            search_results = response.json()
-        elif response.status_code == 401:
+        if status_code == 401:
             return redirect(url_for("login"))
-        else:
-            search_results = []
+        search_results = search_results or []
 
         return render_template("dashboard.html", search_results=search_results)
 
@@ -134,11 +131,12 @@ def search():
 @app.route("/add_coin/<coin_id>", methods=["POST"])
 def add_coin(coin_id):
     access_token = request.cookies.get("access_token")
-    headers = {"Authorization": f"Bearer {access_token}"}
 
-    response = requests.post(
-        FASTAPI_URL + "/portfolio/coin/add/?coin_text_id=" + coin_id + "&currency=usd", headers=headers
-    )
+    try:
+        params = {"coin_text_id": coin_id, "currency": "usd"}
+        response = backend.post("/portfolio/coin/add/", access_token, params=params)
+    except requests.exceptions.RequestException:
+        return {"message": "Error adding coin"}, 502
 
     if response.status_code == 200:
         return {"message": "Coin added successfully"}, 200
@@ -149,9 +147,11 @@ def add_coin(coin_id):
 @app.route("/delete_coin/<coin_id>", methods=["DELETE"])
 def delete_coin(coin_id):
     access_token = request.cookies.get("access_token")
-    headers = {"Authorization": f"Bearer {access_token}"}
 
-    response = requests.delete(FASTAPI_URL + "/portfolio/coin/remove/" + coin_id, headers=headers)
+    try:
+        response = backend.delete("/portfolio/coin/remove/" + coin_id, access_token)
+    except requests.exceptions.RequestException:
+        return {"message": "Error removed coin"}, 502
 
     if response.status_code == 200:
         return {"message": "Coin removed successfully"}, 200
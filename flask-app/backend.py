@@ -0,0 +1,113 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+FASTAPI_URL = os.getenv("FASTAPI_URL", "http://fastapi-app:8000")
+
+BACKEND_CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", 2))
+BACKEND_READ_TIMEOUT = float(os.getenv("BACKEND_READ_TIMEOUT", 10))
+# Keep-alive connections to FastAPI per Flask process
+BACKEND_POOL_SIZE = int(os.getenv("BACKEND_POOL_SIZE", 20))
+# Only failed connection attempts are retried, the request never reached FastAPI then
+BACKEND_CONNECT_RETRIES = int(os.getenv("BACKEND_CONNECT_RETRIES", 2))
+# Threads issuing independent calls of one page concurrently
+BACKEND_FANOUT_WORKERS = int(os.getenv("BACKEND_FANOUT_WORKERS", 8))
+# Responses kept for revalidation with If-None-Match
+BACKEND_ETAG_CACHE_SIZE = int(os.getenv("BACKEND_ETAG_CACHE_SIZE", 1000))
+
+session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=BACKEND_POOL_SIZE,
+    max_retries=Retry(
+        total=BACKEND_CONNECT_RETRIES,
+        connect=BACKEND_CONNECT_RETRIES,
+        read=0,
+        status=0,
+        backoff_factor=0.1,
+    ),
+)
+session.mount("http://", _adapter)
+session.mount("https://", _adapter)
+
+_executor = ThreadPoolExecutor(max_workers=BACKEND_FANOUT_WORKERS, thread_name_prefix="backend")
+
+# (token, path, params) -> (etag, decoded JSON body), most recently used last
+_etag_cache = OrderedDict()
+_etag_cache_lock = threading.Lock()
+
+
+def call(method: str, path: str, token: str | None = None, **kwargs) -> requests.Response:
+    """
+    Send a request to FastAPI over the pooled session, with the access token
+    as bearer authorization when given.
+    """
+    headers = kwargs.pop("headers", {})
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    kwargs.setdefault("timeout", (BACKEND_CONNECT_TIMEOUT, BACKEND_READ_TIMEOUT))
+    return session.request(method, FASTAPI_URL + path, headers=headers, **kwargs)
+
+
+def get(path: str, token: str | None = None, **kwargs) -> requests.Response:
+    return call("GET", path, token, **kwargs)
+
+
+def post(path: str, token: str | None = None, **kwargs) -> requests.Response:
+    return call("POST", path, token, **kwargs)
+
+
+def delete(path: str, token: str | None = None, **kwargs) -> requests.Response:
+    return call("DELETE", path, token, **kwargs)
+
+
+def get_json(path: str, token: str | None = None, params: dict | None = None):
+    """
+    GET a JSON resource, revalidating the copy from a previous call with
+    If-None-Match. Returns (status_code, body); a 304 returns the cached body
+    with status 200, any other error status returns None as the body.
+    """
+    key = (token, path, tuple(sorted((params or {}).items())))
+    with _etag_cache_lock:
+        cached = _etag_cache.get(key)
+
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    response = get(path, token, params=params, headers=headers)
+
+    if response.status_code == 304 and cached:
+        with _etag_cache_lock:
+            if key in _etag_cache:
+                _etag_cache.move_to_end(key)
+        return 200, cached[1]
+    if response.status_code != 200:
+        return response.status_code, None
+
+    body = response.json()
+    etag = response.headers.get("ETag")
+    if etag:
+        with _etag_cache_lock:
+            _etag_cache[key] = (etag, body)
+            _etag_cache.move_to_end(key)
+            while len(_etag_cache) > BACKEND_ETAG_CACHE_SIZE:
+                _etag_cache.popitem(last=False)
+    return 200, body
+
+
+def gather(*calls):
+    """
+    Run independent backend calls concurrently and return their results in order.
+    A call that failed to reach FastAPI yields its RequestException instead of a response.
+    """
+    futures = [_executor.submit(backend_call) for backend_call in calls]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except requests.exceptions.RequestException as e:
+            results.append(e)
+    return results